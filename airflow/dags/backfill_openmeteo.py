@@ -1,4 +1,5 @@
 # dags/backfill_openmeteo.py
+import os
 from airflow import DAG
 from airflow.decorators import task
 from airflow.utils import timezone
@@ -6,6 +7,10 @@ from datetime import timedelta
 
 DEFAULT_ARGS = dict(retries=2, retry_delay=timedelta(minutes=5))
 
+# "fused": validate payloads in memory before uploading them;
+# "s3": the validate task re-reads the written objects from S3
+VALIDATE_MODE = os.getenv("VALIDATE_MODE", "fused")
+
 with DAG(
     dag_id="backfill_openmeteo",
     start_date=timezone.datetime(2025, 10, 30),
@@ -18,14 +23,22 @@ with DAG(
     @task
     def identify_gaps():
         """
-        Query Postgres to find missing hours in the last 7 days.
-        Returns: dict with city -> list of missing datetime objects
+        Find missing hours per city over the last BACKFILL_DAYS (default 7) in
+        one query: expected (city, hour) pairs from generate_series, anti-joined
+        against staging.weather_hourly and collapsed into contiguous ranges.
+        Returns: dict with city -> list of [start, end) ISO timestamp pairs
         """
         import datetime as dt
         import psycopg2
         import os
+        from ingestion.extractor.cities import load_cities
+        from ingestion.loader.load_to_postgres import ensure_ingest_tables
+
+        # the load task records what it loads in staging._ingest_log
+        ensure_ingest_tables()
 
-        CITIES = ["Warsaw", "Berlin", "Paris", "London"]
+        cities = list(load_cities())
+        window_days = int(os.getenv("BACKFILL_DAYS", "7"))
 
         conn = psycopg2.connect(
             host=os.getenv("POSTGRES_HOST", "postgres"),
@@ -36,166 +49,207 @@ with DAG(
         )
 
         end = dt.datetime.now(dt.UTC).replace(minute=0, second=0, microsecond=0)
-        start = end - dt.timedelta(days=7)
+        start = end - dt.timedelta(days=window_days)
 
         gaps = {}
 
         with conn.cursor() as cur:
-            for city in CITIES:
-                # Get all hours that should exist
-                expected_hours = []
-                current = start
-                while current < end:
-                    expected_hours.append(current)
-                    current += dt.timedelta(hours=1)
-
-                # Get existing hours from database
-                cur.execute(
-                    """
-                    SELECT DISTINCT DATE_TRUNC('hour', timestamp_utc) as hour
-                    FROM staging.weather_hourly
-                    WHERE city = %s
-                    AND timestamp_utc >= %s
-                    AND timestamp_utc < %s
-                    ORDER BY hour
-                    """,
-                    (city, start, end),
+            # hour - row_number() * 1h is constant within a run of consecutive
+            # missing hours (gaps-and-islands), so grouping on it yields ranges
+            cur.execute(
+                """
+                WITH expected AS (
+                    SELECT c.city, h.hour
+                    FROM unnest(%(cities)s::text[]) AS c(city)
+                    CROSS JOIN generate_series(
+                        %(start)s::timestamptz,
+                        %(end)s::timestamptz - interval '1 hour',
+                        interval '1 hour'
+                    ) AS h(hour)
+                ),
+                missing AS (
+                    SELECT e.city, e.hour
+                    FROM expected e
+                    WHERE NOT EXISTS (
+                        SELECT 1
+                        FROM staging.weather_hourly w
+                        WHERE w.city = e.city
+                          AND w."timestamp" >= e.hour
+                          AND w."timestamp" < e.hour + interval '1 hour'
+                    )
+                ),
+                islands AS (
+                    SELECT city, hour,
+                           hour - ROW_NUMBER() OVER (
+                               PARTITION BY city ORDER BY hour
+                           ) * interval '1 hour' AS grp
+                    FROM missing
+                )
+                SELECT city, MIN(hour), MAX(hour) + interval '1 hour', COUNT(*)
+                FROM islands
+                GROUP BY city, grp
+                ORDER BY city, MIN(hour)
+                """,
+                {"cities": cities, "start": start, "end": end},
+            )
+
+            for city, gap_start, gap_end, _hours in cur.fetchall():
+                gaps.setdefault(city, []).append(
+                    [
+                        gap_start.astimezone(dt.timezone.utc).isoformat(),
+                        gap_end.astimezone(dt.timezone.utc).isoformat(),
+                    ]
                 )
-
-                existing_hours = {
-                    row[0].replace(tzinfo=dt.timezone.utc) for row in cur.fetchall()
-                }
-
-                missing_hours = [h for h in expected_hours if h not in existing_hours]
-
-                if missing_hours:
-                    gaps[city] = missing_hours
-                    print(f"{city}: {len(missing_hours)} missing hours")
-                else:
-                    print(f"{city}: No gaps found")
 
         conn.close()
 
-        total_gaps = sum(len(v) for v in gaps.values())
-        print(f"\nTotal gaps to backfill: {total_gaps}")
+        print(f"Checked {len(cities)} cities over the last {window_days} days")
+        for city, ranges in gaps.items():
+            hours = sum(
+                (dt.datetime.fromisoformat(e) - dt.datetime.fromisoformat(s))
+                // dt.timedelta(hours=1)
+                for s, e in ranges
+            )
+            print(f"{city}: {hours} missing hours in {len(ranges)} range(s)")
+        print(f"{len(cities) - len(gaps)} cities without gaps")
 
         return gaps
 
     @task
-    def extract_missing(gaps: dict):
+    def extract_missing(gaps: dict, run_id=None):
         """
         Fetch missing hours from Open-Meteo API and write to S3.
-        Returns: dict with keys per city
+        Returns: key of the run manifest listing the objects (None if no gaps)
         """
         import datetime as dt
-        from ingestion.extractor.openmeteo_client import fetch_hourly_data
-        from ingestion.extractor.s3_writer import write_raw
+        from collections import defaultdict
+        from ingestion.extractor.openmeteo_client import (
+            coalesce_windows,
+            fetch_hourly_data_multi,
+            split_payload,
+        )
+        from ingestion.extractor.s3_writer import RAW_LAYOUT, write_raw_many
+        from ingestion.extractor.cities import load_cities
+        from ingestion.extractor.manifest import manifest_entry, write_manifest
 
-        CITY_COORDS = {
-            "Warsaw": (52.23, 21.01),
-            "Berlin": (52.52, 13.41),
-            "Paris": (48.86, 2.35),
-            "London": (51.51, -0.13),
-        }
+        CITY_COORDS = load_cities()
 
         if not gaps:
             print("No gaps to backfill")
-            return {}
-
-        all_results = {}
-
-        for city, missing_hours in gaps.items():
-            print(f"\n--- Backfilling {city}: {len(missing_hours)} hours ---")
-
-            latitude, longitude = CITY_COORDS[city]
-            keys = []
-
-            # Group consecutive hours to minimize API calls
-            if not missing_hours:
+            return None
+
+        entries = []  # manifest entries, one per object
+        failed_writes = 0
+
+        missing_by_city = {}  # city -> set of missing hours
+        cities_by_window = defaultdict(list)  # (start, end) day window -> cities
+        for city, iso_ranges in gaps.items():
+            ranges = [
+                (dt.datetime.fromisoformat(s), dt.datetime.fromisoformat(e))
+                for s, e in iso_ranges
+            ]
+            if not ranges:
                 continue
 
-            missing_hours_sorted = sorted(missing_hours)
-
-            # Fetch in batches (API supports up to ~168 hours)
-            batch_size = 24
-            for i in range(0, len(missing_hours_sorted), batch_size):
-                batch = missing_hours_sorted[i : i + batch_size]
-                batch_start = batch[0]
-                batch_end = batch[-1] + dt.timedelta(hours=1)
-
-                print(f"  Fetching batch: {batch_start} to {batch_end}")
-
-                payload = fetch_hourly_data(
-                    latitude, longitude, batch_start.isoformat(), batch_end.isoformat()
-                )
-
-                hourly = payload.get("hourly", {})
-                times = hourly.get("time", [])
-                temps = hourly.get("temperature_2m", [])
-                precips = hourly.get("precipitation", [])
-                winds = hourly.get("wind_speed_10m", [])
-
-                if not times:
-                    print("  ⚠ No data returned for batch")
+            # set of missing hours for O(1) filtering of the fetched payloads
+            missing = set()
+            for range_start, range_end in ranges:
+                hour = range_start
+                while hour < range_end:
+                    missing.add(hour)
+                    hour += dt.timedelta(hours=1)
+            missing_by_city[city] = missing
+
+            # one window per contiguous run of days (bounded by the API max)
+            windows = coalesce_windows(ranges)
+            print(f"{city}: {len(missing)} missing hours in {len(windows)} window(s)")
+            for window in windows:
+                cities_by_window[window].append(city)
+
+        # cities missing the same window (e.g. after an outage) share one
+        # multi-location request
+        items_by_city = defaultdict(list)  # city -> (city, partition_dt, payload)
+        for (window_start, window_end), window_cities in sorted(
+            cities_by_window.items()
+        ):
+            print(
+                f"\n--- Fetching {window_start} to {window_end} "
+                f"for {len(window_cities)} cities ---"
+            )
+            payloads = fetch_hourly_data_multi(
+                [CITY_COORDS[c] for c in window_cities],
+                window_start.isoformat(),
+                window_end.isoformat(),
+            )
+
+            for city, payload in zip(window_cities, payloads):
+                if not payload.get("hourly", {}).get("time"):
+                    print(f"  ⚠ No data returned for {city}")
                     continue
 
-                # Write each hour as separate file
-                for idx, time_str in enumerate(times):
-                    hour_dt = dt.datetime.fromisoformat(time_str.replace("Z", "+00:00"))
-
+                def is_missing(hour_dt, missing=missing_by_city[city]):
                     if hour_dt.tzinfo is None:
                         hour_dt = hour_dt.replace(tzinfo=dt.timezone.utc)
-
                     # Only write if this hour was in our missing list
-                    if hour_dt not in batch:
-                        continue
-
-                    single_hour_payload = {
-                        "latitude": payload.get("latitude"),
-                        "longitude": payload.get("longitude"),
-                        "timezone": payload.get("timezone"),
-                        "hourly": {
-                            "time": [time_str],
-                            "temperature_2m": (
-                                [temps[idx]] if idx < len(temps) else [None]
-                            ),
-                            "precipitation": (
-                                [precips[idx]] if idx < len(precips) else [None]
-                            ),
-                            "wind_speed_10m": (
-                                [winds[idx]] if idx < len(winds) else [None]
-                            ),
-                        },
-                    }
-
-                    partition_dt = hour_dt.replace(tzinfo=None)
-                    key = write_raw(
-                        "raw",
-                        "weather",
-                        single_hour_payload,
-                        city=city,
-                        partition_dt=partition_dt,
+                    return hour_dt in missing
+
+                # Write each hour (or day, with RAW_LAYOUT=day) as separate file
+                for partition_dt, part in split_payload(
+                    payload, by=RAW_LAYOUT, keep=is_missing
+                ):
+                    items_by_city[city].append(
+                        (city, partition_dt.replace(tzinfo=None), part)
                     )
-                    s3_uri = f"s3://raw/{key}"
-                    keys.append(s3_uri)
 
-            print(f"  ✓ Backfilled {len(keys)} files for {city}")
-            all_results[city] = keys
+        for city, items in items_by_city.items():
+            print(f"\n--- Backfilling {city}: {len(items)} objects ---")
+
+            if VALIDATE_MODE == "fused" and items:
+                from ge.validate_raw_weather import validate_payloads
+
+                # raises before anything of this city is uploaded
+                validate_payloads([(c, part) for c, _, part in items])
+
+            city_files = 0
+            for result in write_raw_many("raw", "weather", items):
+                if result.error:
+                    print(f"  ✗ Write failed: {result.error}")
+                    failed_writes += 1
+                else:
+                    entries.append(manifest_entry(city, "raw", result))
+                    city_files += 1
+
+            print(f"  ✓ Backfilled {city_files} files for {city}")
 
-        total_keys = sum(len(v) for v in all_results.values())
         print("\n=== BACKFILL EXTRACT COMPLETE ===")
-        print(f"Total files: {total_keys}")
+        print(f"Total files: {len(entries)}")
+
+        if failed_writes:
+            # written objects stay; the upsert absorbs hours a retry writes again
+            raise RuntimeError(f"{failed_writes} raw object write(s) failed")
 
-        return all_results
+        manifest_key = write_manifest("raw", f"backfill_openmeteo/{run_id}", entries)
+        print(f"Manifest: s3://raw/{manifest_key}")
+        return manifest_key
 
     @task
-    def validate(all_results: dict):
+    def validate(manifest_key: str | None):
         """Validate backfilled data using Great Expectations."""
+        if VALIDATE_MODE == "fused":
+            print("Payloads were validated in memory by extract_missing before upload.")
+            return manifest_key
+
         from ge.validate_raw_weather import validate_weather_data
+        from ingestion.extractor.manifest import manifest_uris
 
+        all_results = (
+            manifest_uris("raw", manifest_key, written_only=True)
+            if manifest_key
+            else {}
+        )
         if not all_results:
             print("No data to validate")
-            return all_results
+            return manifest_key
 
         print("=" * 70)
         print("GREAT EXPECTATIONS VALIDATION (BACKFILL)")
@@ -207,38 +261,44 @@ with DAG(
         try:
             validate_weather_data(all_results)
             print("\n✅ All backfill data quality checks passed!")
-            return all_results
+            return manifest_key
         except Exception as e:
             print(f"\n❌ BACKFILL VALIDATION FAILED: {e}")
             raise
 
     @task
-    def load(all_results: dict):
+    def load(manifest_key: str | None):
         """Load backfilled data into Postgres."""
-        from ingestion.loader.load_to_postgres import load_one
+        from collections import Counter
+        from ingestion.extractor.manifest import delete_manifest
+        from ingestion.loader.load_to_postgres import load_manifest
 
-        if not all_results:
+        if not manifest_key:
             print("No data to load")
             return 0
 
-        total_rows = 0
-
         print("=== LOADING BACKFILL DATA ===\n")
 
-        for city, keys in all_results.items():
-            print(f"--- Loading {city}: {len(keys)} files ---")
-            city_rows = 0
-
-            for s3_uri in keys:
-                rows = load_one(s3_uri, city)
-                print(f"  ✓ Loaded {s3_uri}: {rows} rows")
-                city_rows += rows or 0
+        # the manifest is streamed once, in batches over one connection;
+        # objects already in staging._ingest_log with the same etag are skipped
+        rows_by_city = Counter()
+        skipped = 0
+        for entry, rows in load_manifest("raw", manifest_key):
+            if rows is None:
+                skipped += 1
+                continue
+            rows_by_city[entry["city"]] += rows
 
-            print(f"Total rows for {city}: {city_rows}\n")
-            total_rows += city_rows
+        for city, city_rows in rows_by_city.items():
+            print(f"Total rows for {city}: {city_rows}")
+        if skipped:
+            print(f"{skipped} file(s) already loaded, skipped")
+        total_rows = sum(rows_by_city.values())
 
-        print("=== BACKFILL LOAD COMPLETE ===")
+        print("\n=== BACKFILL LOAD COMPLETE ===")
         print(f"Total rows loaded: {total_rows}")
+        # kept on failure so a retry can load the same objects
+        delete_manifest("raw", manifest_key)
         return total_rows
 
     # DAG flow
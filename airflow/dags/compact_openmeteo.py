@@ -0,0 +1,55 @@
+# dags/compact_openmeteo.py
+from airflow import DAG
+from airflow.decorators import task
+from airflow.utils import timezone
+from datetime import timedelta
+
+DEFAULT_ARGS = dict(retries=1, retry_delay=timedelta(minutes=10))
+
+with DAG(
+    dag_id="compact_openmeteo",
+    start_date=timezone.datetime(2025, 10, 30),
+    schedule="0 3 * * *",  # daily at 3 AM, after the hourly loads have settled
+    catchup=False,
+    default_args=DEFAULT_ARGS,
+    tags=["openmeteo", "maintenance"],
+) as dag:
+
+    @task
+    def discover():
+        """List the city prefixes present in the raw bucket."""
+        import os
+        from ingestion.extractor.s3_writer import discover_cities
+
+        return discover_cities(
+            os.getenv("S3_BUCKET", "raw"), os.getenv("RAW_PREFIX", "weather")
+        )
+
+    @task
+    def compact(cities: list[str]):
+        """
+        Merge every closed ds= partition into one compacted object per
+        city-day and delete the hourly sources once the result is verified.
+        Partitions with a source newer than COMPACT_MIN_SOURCE_AGE_HOURS (e.g.
+        one a backfill run has yet to load) wait for a later run.
+        """
+        import os
+        from ingestion.extractor.compact_raw import compact_city
+
+        bucket = os.getenv("S3_BUCKET", "raw")
+        prefix = os.getenv("RAW_PREFIX", "weather")
+
+        totals = {}
+        for city in cities:
+            summaries = compact_city(bucket, prefix, city)
+            done = [s for s in summaries if s["status"] == "compacted"]
+            recent = [s for s in summaries if s["status"] == "recent sources, skipped"]
+            totals[city] = len(done)
+            print(
+                f"✓ {city}: compacted {len(done)} partition(s), "
+                f"{sum(s['sources'] for s in done)} source objects removed, "
+                f"{len(recent)} skipped for recent sources"
+            )
+        return totals
+
+    compact(discover())
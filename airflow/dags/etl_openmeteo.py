@@ -1,11 +1,21 @@
 # dags/etl_openmeteo.py
+import os
 from airflow import DAG
-from airflow.decorators import task
+from airflow.decorators import task, task_group
 from airflow.utils import timezone
 from datetime import timedelta
 
-# retries live in default_args for all tasks
-DEFAULT_ARGS = dict(retries=1, retry_delay=timedelta(minutes=1))
+# retries live in default_args for all tasks; every task runs in the
+# openmeteo pool (created by airflow-init), which caps concurrent city lanes
+DEFAULT_ARGS = dict(
+    retries=1,
+    retry_delay=timedelta(minutes=1),
+    pool=os.getenv("OPENMETEO_POOL", "openmeteo"),
+)
+
+# "fused": extract validates payloads in memory before uploading them;
+# "s3": the validate task re-reads the written objects from S3
+VALIDATE_MODE = os.getenv("VALIDATE_MODE", "fused")
 
 with DAG(
     dag_id="etl_openmeteo",
@@ -17,119 +27,109 @@ with DAG(
     tags=["openmeteo"],
 ) as dag:
 
+    @task(pool="default_pool")
+    def list_cities():
+        """
+        City names from the city config (CITIES_CONFIG or the defaults).
+        Also creates the loader bookkeeping tables once, before the mapped
+        load tasks use them concurrently.
+        """
+        from ingestion.extractor.cities import load_cities
+        from ingestion.loader.load_to_postgres import ensure_ingest_tables
+
+        ensure_ingest_tables()
+        return list(load_cities())
+
     @task
-    def extract():
+    def extract(city: str, run_id=None):
         """
-        Fetch last 6 hours of Open-Meteo data for all cities and write one S3 object per hour per city.
-        Returns: dict with keys per city
+        Fetch last 6 hours of Open-Meteo data for one city and write one S3 object per hour
+        (or per city-day with RAW_LAYOUT=day).
+        Returns: key of the run manifest listing the window's objects, written
+        or already present (only the key goes through XCom)
         """
         import datetime as dt
-        from ingestion.extractor.openmeteo_client import fetch_hourly_data
-        from ingestion.extractor.s3_writer import write_raw
+        from ingestion.extractor.async_extract import extract as run_extract
+        from ingestion.extractor.async_extract import hourly_jobs
+        from ingestion.extractor.cities import load_cities
+        from ingestion.extractor.manifest import write_manifest
+
+        validator = None
+        if VALIDATE_MODE == "fused":
+            from ge.validate_raw_weather import validate_payloads as validator
 
-        CITIES = {
-            "Warsaw": (52.23, 21.01),
-            "Berlin": (52.52, 13.41),
-            "Paris": (48.86, 2.35),
-            "London": (51.51, -0.13),
-        }
+        coords = load_cities()[city]
 
         end = dt.datetime.now(dt.UTC).replace(minute=0, second=0, microsecond=0)
         start = end - dt.timedelta(hours=6)
 
-        print(f"Fetching last 6 hours of data for {len(CITIES)} cities")
+        print(f"Fetching last 6 hours of data for {city} {coords}")
         print(f"Time range: {start} to {end}")
 
-        all_results = {}
-
-        for city, (latitude, longitude) in CITIES.items():
-            print(f"\n--- Processing {city} ({latitude}, {longitude}) ---")
-
-            payload = fetch_hourly_data(
-                latitude, longitude, start.isoformat(), end.isoformat()
-            )
-
-            hourly = payload.get("hourly", {})
-            times = hourly.get("time", [])
-            temps = hourly.get("temperature_2m", [])
-            precips = hourly.get("precipitation", [])
-            winds = hourly.get("wind_speed_10m", [])
-
-            if not times:
-                print(f"⚠ No hourly data returned for {city}")
-                continue
-
-            print(f"Got {len(times)} hourly data points from API")
-
-            keys = []
-            for i, time_str in enumerate(times):
-                hour_dt = dt.datetime.fromisoformat(time_str.replace("Z", "+00:00"))
-
-                # Ensure hour_dt is UTC-aware for comparison
-                if hour_dt.tzinfo is None:
-                    hour_dt = hour_dt.replace(tzinfo=dt.timezone.utc)
-
-                # Filter: only keep hours within our 6-hour window
-                if not (start <= hour_dt < end):
-                    continue
-
-                single_hour_payload = {
-                    "latitude": payload.get("latitude"),
-                    "longitude": payload.get("longitude"),
-                    "timezone": payload.get("timezone"),
-                    "hourly": {
-                        "time": [time_str],
-                        "temperature_2m": [temps[i]] if i < len(temps) else [None],
-                        "precipitation": [precips[i]] if i < len(precips) else [None],
-                        "wind_speed_10m": [winds[i]] if i < len(winds) else [None],
-                    },
-                }
-
-                # partition by the *actual* hour as naive dt
-                partition_dt = hour_dt.replace(tzinfo=None)
-                key = write_raw(
-                    "raw",
-                    "weather",
-                    single_hour_payload,
-                    city=city,
-                    partition_dt=partition_dt,
-                )
-                s3_uri = f"s3://raw/{key}"
-                print(f"  ✓ Wrote to {s3_uri}")
-                keys.append(s3_uri)
-
-            print(f"Total files written for {city}: {len(keys)}")
-            all_results[city] = keys
-
-        total_keys = sum(len(v) for v in all_results.values())
-        print("\n=== EXTRACT COMPLETE ===")
-        print(f"Total cities: {len(all_results)}")
-        print(f"Total files: {total_keys}")
-
-        return all_results
+        def in_window(hour_dt):
+            # Ensure hour_dt is UTC-aware for comparison
+            if hour_dt.tzinfo is None:
+                hour_dt = hour_dt.replace(tzinfo=dt.timezone.utc)
+            # Filter: only keep hours within our 6-hour window
+            return start <= hour_dt < end
+
+        # the per-hour writes run concurrently; hours already in the lake with
+        # the same content are not rewritten, but stay in the manifest so load
+        # can pick up anything an earlier attempt wrote and never loaded
+        entries = []
+        run_extract(
+            hourly_jobs({city: coords}, start.isoformat(), end.isoformat()),
+            keep=in_window,
+            entries=entries,
+            validate=validator,
+        )
+
+        written = sum(1 for e in entries if e["written"])
+        if not entries:
+            print(f"⚠ No hourly data in window for {city}")
+        print(
+            f"Total files for {city}: {len(entries)} "
+            f"({written} written, {len(entries) - written} unchanged)"
+        )
+
+        manifest_key = write_manifest("raw", f"etl_openmeteo/{run_id}/{city}", entries)
+        print(f"Manifest: s3://raw/{manifest_key}")
+        return manifest_key
 
     @task
-    def validate(all_results: dict):
+    def validate(manifest_key: str):
         """
         Validate raw weather data using Great Expectations.
         This task runs AFTER extraction and BEFORE loading.
 
         Args:
-            all_results: dict with city names as keys, lists of S3 URIs as values
+            manifest_key: run manifest written by extract
 
         Returns:
-            all_results (passed through on success)
+            manifest_key (passed through on success)
 
         Raises:
             ValueError: if validation fails (blocks the load task)
         """
+        if VALIDATE_MODE == "fused":
+            print("Payloads were validated in memory by extract before upload.")
+            return manifest_key
+
         from ge.validate_raw_weather import validate_weather_data
+        from ingestion.extractor.manifest import manifest_uris
+
+        # unchanged hours passed validation when they were first written
+        all_results = manifest_uris("raw", manifest_key, written_only=True)
 
         print("=" * 70)
         print("GREAT EXPECTATIONS VALIDATION")
         print("=" * 70)
 
         total_files = sum(len(v) for v in all_results.values())
+        if total_files == 0:
+            print("\nNo new or changed hourly data this run; nothing to validate.")
+            return manifest_key
+
         print(f"\nValidating {total_files} files across {len(all_results)} cities")
 
         try:
@@ -139,8 +139,8 @@ with DAG(
             print("\n✅ All data quality checks passed!")
             print("Proceeding to load data into Postgres...\n")
 
-            # Return all_results to pass to next task
-            return all_results
+            # Return the manifest key to pass to next task
+            return manifest_key
 
         except Exception as e:
             print(f"\n❌ VALIDATION FAILED: {e}")
@@ -149,35 +149,42 @@ with DAG(
             raise  # This will fail the task and block the load
 
     @task
-    def load(all_results: dict):
+    def load(manifest_key: str):
         """
         Load each written S3 object into Postgres using your loader.
-        all_results: dict with city names as keys, lists of S3 keys as values
+        manifest_key: run manifest listing the objects to load
         """
-        from ingestion.loader.load_to_postgres import load_one
-
-        total_rows = 0
-
-        print(f"=== LOADING DATA FOR {len(all_results)} CITIES ===\n")
+        from ingestion.extractor.manifest import delete_manifest
+        from ingestion.loader.load_to_postgres import load_manifest
 
-        for city, keys in all_results.items():
-            print(f"--- Loading {city}: {len(keys)} files ---")
-            city_rows = 0
+        print("=== LOADING DATA ===\n")
 
-            for s3_uri in keys:
-                rows = load_one(s3_uri, city)
-                print(f"  ✓ Loaded {s3_uri}: {rows} rows")
-                city_rows += rows or 0
+        # the manifest is streamed once, in batches over one connection;
+        # objects already in staging._ingest_log with the same etag are skipped
+        total_rows = 0
+        files = 0
+        for entry, rows in load_manifest("raw", manifest_key):
+            files += 1
+            if rows is None:
+                print(f"  = Already loaded {entry['uri']}")
+                continue
+            print(f"  ✓ Loaded {entry['uri']}: {rows} rows")
+            total_rows += rows
 
-            print(f"Total rows for {city}: {city_rows}\n")
-            total_rows += city_rows
+        if not files:
+            print("No hourly data this run; nothing to load.")
 
         print("=== LOAD COMPLETE ===")
-        print(f"Total rows loaded across all cities: {total_rows}")
+        print(f"Total rows loaded: {total_rows}")
+        # kept on failure so a retry can load the same objects
+        delete_manifest("raw", manifest_key)
         return total_rows
 
-    # DAG flow: extract -> validate -> load
-    # The validate task will block load if validation fails
-    extracted_data = extract()
-    validated_data = validate(extracted_data)
-    load(validated_data)
+    @task_group
+    def city_lane(city: str):
+        # extract -> validate -> load for one city; validate blocks the load
+        # if validation fails, and a retry only redoes this city
+        load(validate(extract(city)))
+
+    # one mapped lane per configured city
+    city_lane.expand(city=list_cities())
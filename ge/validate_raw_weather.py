@@ -1,7 +1,8 @@
 """
 Great Expectations validation for raw weather data from S3/MinIO.
 
-This script validates raw JSON files written by the extractor before loading to Postgres.
+This script validates raw JSON/Parquet files written by the extractor before loading to Postgres.
+The extractor can also validate payloads in memory before uploading them (validate_payloads).
 It checks:
 - Required fields exist and are not null
 - Temperature bounds are reasonable
@@ -13,36 +14,62 @@ Uses Great Expectations 1.8+ Fluent API.
 """
 
 import os
-import json
-import boto3
-from botocore.config import Config
-from typing import Dict, List
+import sys
+import threading
+from typing import Dict, Iterable, List, Tuple
 import great_expectations as gx
 import pandas as pd
 
+try:
+    from ingestion.extractor.s3_writer import get_s3_client, read_raw
+except ModuleNotFoundError:  # run as a script from ge/
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from ingestion.extractor.s3_writer import get_s3_client, read_raw
 
-def _resolve_endpoint() -> str:
-    """Resolve MinIO endpoint from environment variables."""
-    ep = (
-        os.getenv("MINIO_ENDPOINT_URL")
-        or os.getenv("MINIO_ENDPOINT")
-        or "http://localhost:9000"
-    )
-    if not ep.startswith("http"):
-        ep = f"http://{ep}"
-    return ep
-
-
-def _get_s3_client():
-    """Create boto3 S3 client for MinIO."""
-    return boto3.client(
-        "s3",
-        endpoint_url=_resolve_endpoint(),
-        aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
-        aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD"),
-        region_name=os.getenv("MINIO_REGION", "us-east-1"),
-        config=Config(s3={"addressing_style": "path"}),
-    )
+SUITE_NAME = "openmeteo_raw_weather_suite"
+# Optional directory of a persisted GX file context; ephemeral if unset
+GX_CONTEXT_DIR = os.getenv("GX_CONTEXT_DIR")
+
+# Built once per process by _get_validation_definition; GX objects are not
+# thread-safe, so setup and runs are serialized
+_VALIDATION_DEFINITION = None
+_GX_LOCK = threading.Lock()
+
+
+def payload_records(city: str, payload: dict, s3_uri: str = None) -> List[dict]:
+    """
+    Flatten one raw payload into records, one per hourly data point.
+
+    Args:
+        city: City the payload belongs to
+        payload: Payload dict as returned by the API / read_raw
+        s3_uri: Object the payload came from, if any
+
+    Returns:
+        List of flattened records
+    """
+    hourly = payload.get("hourly", {})
+    times = hourly.get("time", [])
+    temps = hourly.get("temperature_2m", [])
+    precips = hourly.get("precipitation", [])
+    winds = hourly.get("wind_speed_10m", [])
+
+    # Create one record per hourly data point
+    records = []
+    for i in range(len(times)):
+        record = {
+            "city": city,
+            "s3_uri": s3_uri,
+            "latitude": payload.get("latitude"),
+            "longitude": payload.get("longitude"),
+            "timezone": payload.get("timezone"),
+            "time": times[i] if i < len(times) else None,
+            "temperature_2m": temps[i] if i < len(temps) else None,
+            "precipitation": precips[i] if i < len(precips) else None,
+            "wind_speed_10m": winds[i] if i < len(winds) else None,
+        }
+        records.append(record)
+    return records
 
 
 def fetch_s3_objects_as_records(all_results: Dict[str, List[str]]) -> List[dict]:
@@ -55,7 +82,7 @@ def fetch_s3_objects_as_records(all_results: Dict[str, List[str]]) -> List[dict]
     Returns:
         List of flattened records, one per hourly data point
     """
-    s3_client = _get_s3_client()
+    s3_client = get_s3_client()
     records = []
 
     for city, s3_uris in all_results.items():
@@ -67,30 +94,9 @@ def fetch_s3_objects_as_records(all_results: Dict[str, List[str]]) -> List[dict]
 
             # Fetch object
             try:
-                obj = s3_client.get_object(Bucket=bucket, Key=key)
-                payload = json.loads(obj["Body"].read())
-
-                # Extract hourly data
-                hourly = payload.get("hourly", {})
-                times = hourly.get("time", [])
-                temps = hourly.get("temperature_2m", [])
-                precips = hourly.get("precipitation", [])
-                winds = hourly.get("wind_speed_10m", [])
-
-                # Create one record per hourly data point
-                for i in range(len(times)):
-                    record = {
-                        "city": city,
-                        "s3_uri": s3_uri,
-                        "latitude": payload.get("latitude"),
-                        "longitude": payload.get("longitude"),
-                        "timezone": payload.get("timezone"),
-                        "time": times[i] if i < len(times) else None,
-                        "temperature_2m": temps[i] if i < len(temps) else None,
-                        "precipitation": precips[i] if i < len(precips) else None,
-                        "wind_speed_10m": winds[i] if i < len(winds) else None,
-                    }
-                    records.append(record)
+                # JSON or Parquet, decoded by the writer's own codec
+                payload = read_raw(bucket, key, s3_client)
+                records.extend(payload_records(city, payload, s3_uri))
 
             except Exception as e:
                 print(f"Error fetching {s3_uri}: {e}")
@@ -101,7 +107,9 @@ def fetch_s3_objects_as_records(all_results: Dict[str, List[str]]) -> List[dict]
 
 def validate_weather_data(all_results: Dict[str, List[str]]) -> dict:
     """
-    Validate weather data using Great Expectations 1.8+ Fluent API.
+    Validate weather data already written to S3 using Great Expectations 1.8+
+    Fluent API (re-reads every object; see validate_payloads for the
+    in-memory path used before upload).
 
     Args:
         all_results: Dict with city names as keys, lists of S3 URIs as values
@@ -118,28 +126,34 @@ def validate_weather_data(all_results: Dict[str, List[str]]) -> dict:
     )
     records = fetch_s3_objects_as_records(all_results)
     print(f"Fetched {len(records)} hourly records")
+    return validate_records(records)
 
-    if not records:
-        raise ValueError("No records found to validate")
 
-    df = pd.DataFrame(records)
-    print(f"DataFrame shape: {df.shape}")
+def validate_payloads(payloads: Iterable[Tuple[str, dict]]) -> dict:
+    """
+    Validate payloads in memory, before they are uploaded, so bad data never
+    lands in raw/ and no objects have to be downloaded again.
 
-    # Create ephemeral GX context
-    context = gx.get_context(mode="ephemeral")
+    Args:
+        payloads: (city, payload) pairs
 
-    # Add pandas datasource with dataframe asset
-    datasource = context.data_sources.add_pandas("weather_datasource")
-    data_asset = datasource.add_dataframe_asset(name="weather_hourly")
+    Returns:
+        Validation results dict
+
+    Raises:
+        ValueError: if validation fails
+    """
+    records = []
+    for city, payload in payloads:
+        records.extend(payload_records(city, payload))
+    print(f"Validating {len(records)} hourly records in memory")
+    return validate_records(records)
 
-    # Add batch definition with dataframe
-    batch_definition = data_asset.add_batch_definition_whole_dataframe("weather_batch")
 
-    # Create expectation suite
-    suite_name = "openmeteo_raw_weather_suite"
-    suite = context.suites.add(gx.ExpectationSuite(name=suite_name))
+def _build_suite() -> "gx.ExpectationSuite":
+    """The expectation suite for raw weather records."""
+    suite = gx.ExpectationSuite(name=SUITE_NAME)
 
-    # Add expectations to suite
     suite.add_expectation(gx.expectations.ExpectColumnValuesToNotBeNull(column="time"))
     suite.add_expectation(gx.expectations.ExpectColumnValuesToNotBeNull(column="city"))
     suite.add_expectation(
@@ -166,15 +180,69 @@ def validate_weather_data(all_results: Dict[str, List[str]]) -> dict:
             column="wind_speed_10m", min_value=0.0, max_value=200.0, mostly=1.0
         )
     )
+    return suite
+
+
+def _get_validation_definition():
+    """
+    Return the validation definition, building the GX context, datasource,
+    asset, batch definition and suite on first use only. Callers hold
+    _GX_LOCK.
+
+    Uses an ephemeral context unless GX_CONTEXT_DIR points at a file context;
+    the suite and definitions there are refreshed from this module once per
+    process, so they never drift from the code.
+    """
+    global _VALIDATION_DEFINITION
+    if _VALIDATION_DEFINITION is not None:
+        return _VALIDATION_DEFINITION
+
+    if GX_CONTEXT_DIR:
+        context = gx.get_context(mode="file", project_root_dir=GX_CONTEXT_DIR)
+    else:
+        context = gx.get_context(mode="ephemeral")
+
+    # Add pandas datasource with dataframe asset
+    datasource = context.data_sources.add_or_update_pandas("weather_datasource")
+    data_asset = datasource.add_dataframe_asset(name="weather_hourly")
+
+    # Add batch definition with dataframe
+    batch_definition = data_asset.add_batch_definition_whole_dataframe("weather_batch")
+
+    suite = context.suites.add_or_update(_build_suite())
 
     # Create validation definition with batch definition
-    validation_definition = gx.ValidationDefinition(
-        data=batch_definition, suite=suite, name="weather_validation"
+    _VALIDATION_DEFINITION = context.validation_definitions.add_or_update(
+        gx.ValidationDefinition(
+            data=batch_definition, suite=suite, name="weather_validation"
+        )
     )
-    validation_definition = context.validation_definitions.add(validation_definition)
+    return _VALIDATION_DEFINITION
+
+
+def validate_records(records: List[dict]) -> dict:
+    """
+    Run the expectation suite over flattened records.
+
+    Args:
+        records: Records as built by payload_records
+
+    Returns:
+        Validation results dict
+
+    Raises:
+        ValueError: if there are no records or validation fails
+    """
+    if not records:
+        raise ValueError("No records found to validate")
+
+    df = pd.DataFrame(records)
+    print(f"DataFrame shape: {df.shape}")
 
-    # Run validation with dataframe
-    results = validation_definition.run(batch_parameters={"dataframe": df})
+    # Run validation with dataframe (the only per-run input)
+    with _GX_LOCK:
+        validation_definition = _get_validation_definition()
+        results = validation_definition.run(batch_parameters={"dataframe": df})
 
     # Process and display results
     _print_validation_results(results)
@@ -234,7 +302,7 @@ if __name__ == "__main__":
     # Test with sample data structure
     sample_results = {
         "Warsaw": [
-            "s3://raw/weather/Warsaw/ds=2025-10-31/hour=12/openmeteo_20251031T120000.json"
+            "s3://raw/weather/Warsaw/ds=2025-10-31/hour=12/openmeteo_20251031T12.json"
         ]
     }
 
@@ -0,0 +1,108 @@
+"""
+Shared fixtures for the ingestion tests: an in-memory S3 client.
+"""
+
+import hashlib
+import io
+import threading
+import time
+
+import pytest
+
+from ingestion.extractor import s3_writer
+
+
+class FakeS3:
+    """In-memory stand-in for the boto3 S3 calls the ingestion code makes."""
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> {"Body", "ETag", "Metadata", ...}
+        self.calls = []
+        self.list_delay = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        with self._lock:
+            self.calls.append(name)
+
+    def count(self, name):
+        return self.calls.count(name)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **headers):
+        self._record("PutObject")
+        data = Body.read() if hasattr(Body, "read") else Body
+        self.objects[(Bucket, Key)] = {
+            "Body": data,
+            "ETag": hashlib.md5(data).hexdigest(),
+            "Metadata": Metadata or {},
+            **headers,
+        }
+        return {"ETag": f'"{self.objects[(Bucket, Key)]["ETag"]}"'}
+
+    def get_object(self, Bucket, Key):
+        self._record("GetObject")
+        obj = self.objects[(Bucket, Key)]
+        return {
+            **obj,
+            "Body": io.BytesIO(obj["Body"]),
+            "ContentLength": len(obj["Body"]),
+        }
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+
+        self._record("HeadObject")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        obj = self.objects[(Bucket, Key)]
+        return {
+            "ETag": f'"{obj["ETag"]}"',
+            "Metadata": obj["Metadata"],
+            "ContentLength": len(obj["Body"]),
+        }
+
+    def delete_object(self, Bucket, Key):
+        self._record("DeleteObject")
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        self._record("ListObjectsV2")
+        time.sleep(self.list_delay)
+        keys = sorted(
+            k for b, k in self.objects if b == Bucket and k.startswith(Prefix)
+        )
+        if Delimiter:
+            # keys with a delimiter after the prefix roll up into "folders"
+            folders = {
+                Prefix + k[len(Prefix) :].split(Delimiter, 1)[0] + Delimiter
+                for k in keys
+                if Delimiter in k[len(Prefix) :]
+            }
+            keys = [k for k in keys if Delimiter not in k[len(Prefix) :]]
+            yield {
+                "Contents": [
+                    {"Key": k, "ETag": f'"{self.objects[(Bucket, k)]["ETag"]}"'}
+                    for k in keys
+                ],
+                "CommonPrefixes": [{"Prefix": p} for p in sorted(folders)],
+            }
+            return
+        yield {
+            "Contents": [
+                {"Key": key, "ETag": f'"{self.objects[(Bucket, key)]["ETag"]}"'}
+                for key in keys
+            ]
+        }
+
+
+@pytest.fixture
+def fake_s3():
+    """A FakeS3 installed as the shared client for the duration of a test."""
+    s3 = FakeS3()
+    s3_writer.set_s3_client(s3)
+    yield s3
+    s3_writer.set_s3_client(None)
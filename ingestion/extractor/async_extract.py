@@ -0,0 +1,257 @@
+"""
+Asyncio extraction engine.
+
+Runs Open-Meteo fetches and the S3 writes of many cities concurrently
+under one global concurrency limit, so wall time follows the slowest city
+instead of the sum of all of them. The blocking HTTP and boto3 calls run in
+worker threads via asyncio.to_thread.
+"""
+
+import asyncio
+import datetime as dt
+from typing import Callable
+
+try:
+    from ingestion.extractor.openmeteo_client import (
+        fetch_archive_range,
+        fetch_hourly_data_multi,
+        split_payload,
+    )
+    from ingestion.extractor.s3_writer import (
+        RAW_LAYOUT,
+        CoverageIndex,
+        PreparedRaw,
+        prepare_raw_item,
+        upload_prepared,
+    )
+    from ingestion.extractor.manifest import manifest_entry
+except ModuleNotFoundError:  # run as a script from ingestion/extractor/
+    from openmeteo_client import (
+        fetch_archive_range,
+        fetch_hourly_data_multi,
+        split_payload,
+    )
+    from s3_writer import (
+        RAW_LAYOUT,
+        CoverageIndex,
+        PreparedRaw,
+        prepare_raw_item,
+        upload_prepared,
+    )
+    from manifest import manifest_entry
+
+# A fetch job: the cities it covers and a blocking callable that returns one
+# payload per city, in the same order.
+FetchJob = tuple[list[str], Callable[[], list[dict]]]
+# Checks (city, payload) pairs before they are uploaded; raises to reject them
+Validator = Callable[[list[tuple[str, dict]]], object]
+
+
+def hourly_jobs(
+    cities: dict[str, tuple[float, float]],
+    start_iso: str,
+    end_iso: str,
+    chunk_size: int = 100,
+) -> list[FetchJob]:
+    """
+    Build multi-location forecast jobs, chunk_size cities per request.
+    """
+    names = list(cities)
+    jobs = []
+    for i in range(0, len(names), chunk_size):
+        chunk = names[i : i + chunk_size]
+        locations = [cities[c] for c in chunk]
+        jobs.append(
+            (
+                chunk,
+                lambda locations=locations: fetch_hourly_data_multi(
+                    locations, start_iso, end_iso, chunk_size=chunk_size
+                ),
+            )
+        )
+    return jobs
+
+
+def archive_jobs(
+    cities: dict[str, tuple[float, float]],
+    start_date: str,
+    end_date: str,
+    failed: dict[str, list] | None = None,
+) -> list[FetchJob]:
+    """
+    Build one historical-range job per city (see fetch_archive_range).
+
+    If failed is given, windows that could not be fetched are collected in
+    failed[city] as (start_date, end_date) pairs instead of failing the run.
+    """
+    jobs = []
+    for city, (lat, lon) in cities.items():
+        city_failed = failed.setdefault(city, []) if failed is not None else None
+        jobs.append(
+            (
+                [city],
+                lambda lat=lat, lon=lon, city_failed=city_failed: [
+                    fetch_archive_range(
+                        lat, lon, start_date, end_date, failed=city_failed
+                    )
+                ],
+            )
+        )
+    return jobs
+
+
+async def _prepare_item(
+    sem: asyncio.Semaphore,
+    bucket: str,
+    prefix: str,
+    item: tuple[str, dt.datetime, dict],
+    layout: str,
+    coverage: CoverageIndex,
+):
+    # encode + coverage check (one LIST per city-day, shared via coverage)
+    async with sem:
+        return await asyncio.to_thread(
+            prepare_raw_item, bucket, prefix, item, layout=layout, coverage=coverage
+        )
+
+
+async def _upload_item(
+    sem: asyncio.Semaphore, bucket: str, prepared: PreparedRaw, coverage: CoverageIndex
+):
+    if prepared.existing_md5 is not None:
+        return upload_prepared(bucket, prepared)  # kept as is, no I/O
+    # one slot per upload, shared with the fetches: concurrency stays global
+    async with sem:
+        return await asyncio.to_thread(upload_prepared, bucket, prepared, coverage)
+
+
+async def _run_job(
+    sem: asyncio.Semaphore,
+    job: FetchJob,
+    bucket: str,
+    prefix: str,
+    keep: Callable[[dt.datetime], bool] | None,
+    layout: str,
+    coverage: CoverageIndex,
+    entries: list[dict] | None,
+    validate: Validator | None,
+) -> list[tuple[str, list[str]]]:
+    cities, fetch = job
+    async with sem:
+        payloads = await asyncio.to_thread(fetch)
+
+    items = [
+        (city, partition_dt.replace(tzinfo=None), part)
+        for city, payload in zip(cities, payloads)
+        for partition_dt, part in split_payload(payload, by=layout, keep=keep)
+    ]
+    prepared = await asyncio.gather(
+        *(_prepare_item(sem, bucket, prefix, item, layout, coverage) for item in items)
+    )
+
+    # only new or changed objects are validated and uploaded; unchanged ones
+    # passed validation when they were first written
+    changed = [(item, p) for item, p in zip(items, prepared) if p.existing_md5 is None]
+    if validate is not None and changed:
+        # nothing of this job is uploaded unless all of it passes
+        await asyncio.to_thread(
+            validate, [(city, part) for (city, _, part), _ in changed]
+        )
+
+    results = await asyncio.gather(
+        *(_upload_item(sem, bucket, p, coverage) for p in prepared)
+    )
+
+    per_city = {city: [] for city in cities}
+    for (city, _, _), result in zip(items, results):
+        if result.error:
+            raise result.error
+        # unchanged objects are reported too: being in the lake does not mean
+        # they were loaded (e.g. a failed earlier attempt), the loader skips
+        # what staging._ingest_log already has
+        per_city[city].append(f"s3://{bucket}/{result.key}")
+        if entries is not None:
+            entries.append(manifest_entry(city, bucket, result))
+    return list(per_city.items())
+
+
+async def extract_async(
+    jobs: list[FetchJob],
+    concurrency: int = 16,
+    bucket: str = "raw",
+    prefix: str = "weather",
+    keep: Callable[[dt.datetime], bool] | None = None,
+    layout: str | None = None,
+    entries: list[dict] | None = None,
+    validate: Validator | None = None,
+) -> dict[str, list[str]]:
+    """
+    Run fetch jobs and their S3 writes concurrently.
+
+    Hours whose object already exists with identical content are not
+    re-uploaded (one listing per city-day, see s3_writer.CoverageIndex), so
+    re-extracting an overlapping window only PUTs what is new or changed.
+    Such hours are still returned, flagged written=False in entries.
+
+    Args:
+        jobs: Fetch jobs, e.g. from hourly_jobs()
+        concurrency: Max fetches + writes in flight at any time
+        bucket: Target bucket
+        prefix: Key prefix (e.g., 'weather')
+        keep: Optional filter on each hour's timestamp; hours it rejects are not written
+        layout: "hour" (one object per hour) or "day" (one object per city-day);
+            defaults to s3_writer.RAW_LAYOUT
+        entries: Optional list that collects a manifest entry (city, uri,
+            rows, md5, written) per object, see manifest.write_manifest
+        validate: Optional check run on each job's new or changed payloads in
+            memory before any of them is uploaded (e.g.
+            ge.validate_raw_weather.validate_payloads); an exception fails the
+            extract and nothing of that job is written
+
+    Returns:
+        Dict with city names as keys, lists of S3 URIs (written or already
+        present unchanged) as values
+    """
+    sem = asyncio.Semaphore(concurrency)
+    layout = layout or RAW_LAYOUT
+    coverage = CoverageIndex(bucket)
+    done = await asyncio.gather(
+        *(
+            _run_job(
+                sem,
+                job,
+                bucket,
+                prefix,
+                keep,
+                layout,
+                coverage,
+                entries,
+                validate,
+            )
+            for job in jobs
+        )
+    )
+
+    all_results = {}
+    for job_results in done:
+        for city, uris in job_results:
+            all_results.setdefault(city, []).extend(uris)
+    return all_results
+
+
+def extract(
+    jobs: list[FetchJob],
+    concurrency: int = 16,
+    bucket: str = "raw",
+    prefix: str = "weather",
+    keep: Callable[[dt.datetime], bool] | None = None,
+    layout: str | None = None,
+    entries: list[dict] | None = None,
+    validate: Validator | None = None,
+) -> dict[str, list[str]]:
+    """Blocking wrapper around extract_async for scripts and Airflow tasks."""
+    return asyncio.run(
+        extract_async(
+            jobs, concurrency, bucket, prefix, keep, layout, entries, validate
+        )
+    )
@@ -0,0 +1,35 @@
+"""
+City coordinates used by the extract and backfill DAGs.
+
+Defaults to the four pre-configured cities. Point CITIES_CONFIG at a JSON
+file to use another list, e.g. {"Madrid": [40.42, -3.70], ...}.
+"""
+
+import os
+import json
+
+DEFAULT_CITIES = {
+    "Warsaw": (52.23, 21.01),
+    "Berlin": (52.52, 13.41),
+    "Paris": (48.86, 2.35),
+    "London": (51.51, -0.13),
+}
+
+
+def load_cities(path: str = None) -> dict[str, tuple[float, float]]:
+    """
+    Load the configured cities.
+
+    Args:
+        path: JSON file mapping city name to [latitude, longitude]; defaults
+            to the CITIES_CONFIG environment variable, else DEFAULT_CITIES
+
+    Returns:
+        Dict with city names as keys, (latitude, longitude) as values
+    """
+    path = path or os.getenv("CITIES_CONFIG")
+    if not path:
+        return dict(DEFAULT_CITIES)
+    with open(path) as f:
+        data = json.load(f)
+    return {city: (float(lat), float(lon)) for city, (lat, lon) in data.items()}
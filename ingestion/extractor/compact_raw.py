@@ -0,0 +1,265 @@
+"""
+Compact closed raw partitions into one compressed object per city-day.
+
+Hourly extracts leave 24+ tiny objects per city per day under
+weather/{city}/ds=YYYY-MM-DD/hour=HH/. For every ds= partition older than the
+grace period this job merges them into
+
+    weather/{city}/ds=YYYY-MM-DD/openmeteo_YYYYMMDD_compacted.json.gz
+
+(.json.zst with COMPACT_COMPRESSION=zstd), writes a manifest of the source
+keys to _manifests/compaction/..., verifies the compacted object and only
+then deletes the sources. A partition with a source written in the last
+COMPACT_MIN_SOURCE_AGE_HOURS is left alone: a backfill run may have written
+it and still have to validate and load it from its run manifest.
+
+Usage:
+    python compact_raw.py              # all cities
+    python compact_raw.py Warsaw       # one city
+    DRY_RUN=1 python compact_raw.py    # report only, write/delete nothing
+"""
+
+import os
+import io
+import json
+import datetime as dt
+
+try:
+    from ingestion.extractor.s3_writer import (
+        discover_cities,
+        encode_raw,
+        get_s3_client,
+        raw_extension,
+        read_raw,
+    )
+except ModuleNotFoundError:  # run as a script from ingestion/extractor/
+    from s3_writer import (
+        discover_cities,
+        encode_raw,
+        get_s3_client,
+        raw_extension,
+        read_raw,
+    )
+
+MANIFEST_PREFIX = "_manifests/compaction"
+# compacted days are read rarely, so compress them even if hourly objects aren't
+COMPACT_COMPRESSION = os.getenv("COMPACT_COMPRESSION", "gzip")
+# only ds= partitions older than this many days (UTC) are compacted
+GRACE_DAYS = int(os.getenv("COMPACT_GRACE_DAYS", "2"))
+# partitions with a source younger than this are skipped (see module docstring)
+MIN_SOURCE_AGE = dt.timedelta(
+    hours=int(os.getenv("COMPACT_MIN_SOURCE_AGE_HOURS", "24"))
+)
+HOURLY_FIELDS = ("temperature_2m", "precipitation", "wind_speed_10m")
+
+
+def _list_prefixes(bucket: str, prefix: str) -> list[str]:
+    """List the immediate "folders" under prefix (CommonPrefixes)."""
+    prefixes = []
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    return prefixes
+
+
+def _list_objects(bucket: str, prefix: str) -> list[tuple[str, str, dt.datetime]]:
+    """List (key, etag, last_modified) of every object under prefix."""
+    objects = []
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            etag = (obj.get("ETag") or "").strip('"')
+            objects.append((obj["Key"], etag, obj.get("LastModified")))
+    return objects
+
+
+def compacted_key(
+    prefix: str, city: str, day: dt.date, compression: str = COMPACT_COMPRESSION
+) -> str:
+    ext = raw_extension("json", compression)
+    return f"{prefix}/{city}/ds={day:%Y-%m-%d}/openmeteo_{day:%Y%m%d}_compacted.{ext}"
+
+
+def _merge_payloads(payloads: list[dict]) -> dict:
+    """
+    Merge payloads of one city-day by hour; later payloads win for an hour
+    present in several objects (same rule as the loader).
+    """
+    merged = {}
+    by_hour = {}
+    for payload in payloads:
+        for key in ("latitude", "longitude", "timezone"):
+            if payload.get(key) is not None:
+                merged[key] = payload[key]
+        hourly = payload.get("hourly") or {}
+        for i, time_str in enumerate(hourly.get("time") or []):
+            by_hour[time_str] = [
+                (hourly.get(f) or [])[i] if i < len(hourly.get(f) or []) else None
+                for f in HOURLY_FIELDS
+            ]
+
+    times = sorted(by_hour)
+    merged["hourly"] = {"time": times}
+    for n, field in enumerate(HOURLY_FIELDS):
+        merged["hourly"][field] = [by_hour[t][n] for t in times]
+    return merged
+
+
+def compact_partition(
+    bucket: str,
+    prefix: str,
+    city: str,
+    day: dt.date,
+    delete_sources: bool = True,
+    dry_run: bool = False,
+    min_source_age: dt.timedelta = MIN_SOURCE_AGE,
+) -> dict:
+    """
+    Compact one city-day partition.
+
+    An existing compacted object is merged in (lowest priority) and never
+    deleted, so late objects can be folded in by running the job again.
+    The partition is skipped while any source is younger than min_source_age.
+
+    Returns:
+        Summary dict with the source count, rows and compacted key
+    """
+    s3 = get_s3_client()
+    target = compacted_key(prefix, city, day)
+    listed = _list_objects(bucket, f"{prefix}/{city}/ds={day:%Y-%m-%d}/")
+    # oldest write first; a compacted object written with another
+    # compression goes before everything else
+    sources = [
+        (k, e)
+        for k, e, _ in sorted(
+            (o for o in listed if o[0] != target),
+            key=lambda o: (
+                "_compacted." not in o[0],
+                o[2].timestamp() if o[2] else 0,
+                o[0],
+            ),
+        )
+    ]
+    summary = {"city": city, "ds": day.isoformat(), "sources": len(sources)}
+    if not sources:
+        summary["status"] = "nothing to compact"
+        return summary
+
+    newest = max((o[2] for o in listed if o[0] != target and o[2]), default=None)
+    if newest and newest > dt.datetime.now(dt.UTC) - min_source_age:
+        summary["status"] = "recent sources, skipped"
+        return summary
+
+    keys = ([target] if len(sources) < len(listed) else []) + [k for k, _ in sources]
+    merged = _merge_payloads([read_raw(bucket, k) for k in keys])
+    times = merged["hourly"]["time"]
+    summary.update(key=target, rows=len(times))
+    if dry_run:
+        summary["status"] = "dry run"
+        return summary
+
+    body, headers = encode_raw(merged, "json", COMPACT_COMPRESSION)
+    s3.put_object(
+        Bucket=bucket,
+        Key=target,
+        Body=io.BytesIO(body),
+        **headers,
+        Metadata={
+            "hour-start": times[0] if times else "",
+            "hour-end": times[-1] if times else "",
+            "source-count": str(len(sources)),
+        },
+    )
+
+    # verify before touching the sources: size matches and every hour reads back
+    head = s3.head_object(Bucket=bucket, Key=target)
+    if head["ContentLength"] != len(body):
+        raise RuntimeError(f"Size mismatch after writing s3://{bucket}/{target}")
+    if read_raw(bucket, target)["hourly"]["time"] != times:
+        raise RuntimeError(f"Content mismatch after writing s3://{bucket}/{target}")
+
+    manifest = {
+        "compacted_key": target,
+        "compacted_etag": head["ETag"].strip('"'),
+        "rows": len(times),
+        "hour_start": times[0] if times else None,
+        "hour_end": times[-1] if times else None,
+        "sources": [{"key": k, "etag": e} for k, e in sources],
+        "compacted_at": dt.datetime.now(dt.UTC).isoformat(),
+    }
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{MANIFEST_PREFIX}/{prefix}/{city}/ds={day:%Y-%m-%d}.json",
+        Body=io.BytesIO(json.dumps(manifest).encode()),
+        ContentType="application/json",
+    )
+
+    if delete_sources:
+        errors = []
+        for i in range(0, len(sources), 1000):
+            resp = s3.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [{"Key": k} for k, _ in sources[i : i + 1000]],
+                    "Quiet": True,
+                },
+            )
+            # Quiet mode only reports failures; the call itself still succeeds
+            errors.extend(resp.get("Errors", []))
+        if errors:
+            first = errors[0]
+            raise RuntimeError(
+                f"Failed to delete {len(errors)} source(s) of s3://{bucket}/{target}, "
+                f"e.g. {first.get('Key')}: {first.get('Code')} {first.get('Message')}"
+            )
+    summary["status"] = "compacted"
+    return summary
+
+
+def compact_city(
+    bucket: str,
+    prefix: str,
+    city: str,
+    grace_days: int = GRACE_DAYS,
+    delete_sources: bool = True,
+    dry_run: bool = False,
+    min_source_age: dt.timedelta = MIN_SOURCE_AGE,
+) -> list[dict]:
+    """
+    Compact every closed ds= partition of a city.
+
+    A partition is closed once it is older than grace_days before today (UTC);
+    the hourly DAG re-extracts the last few hours, so recent days still change.
+    Older days can still receive backfilled objects; partitions holding one
+    younger than min_source_age are skipped until a later run.
+    """
+    cutoff = dt.datetime.now(dt.UTC).date() - dt.timedelta(days=grace_days)
+    summaries = []
+    for ds_prefix in _list_prefixes(bucket, f"{prefix}/{city}/"):
+        ds = ds_prefix.rstrip("/").rsplit("ds=", 1)[-1]
+        try:
+            day = dt.date.fromisoformat(ds)
+        except ValueError:
+            continue  # not a ds= partition
+        if day >= cutoff:
+            continue
+        summaries.append(
+            compact_partition(
+                bucket, prefix, city, day, delete_sources, dry_run, min_source_age
+            )
+        )
+    return summaries
+
+
+if __name__ == "__main__":
+    import sys
+
+    bucket = os.getenv("S3_BUCKET", "raw")
+    prefix = os.getenv("RAW_PREFIX", "weather")
+    dry_run = os.getenv("DRY_RUN", "").lower() in {"1", "true", "yes", "on"}
+
+    cities = sys.argv[1:] or discover_cities(bucket, prefix)
+    for city in cities:
+        print(f"\n--- Compacting {city} ---")
+        for s in compact_city(bucket, prefix, city, dry_run=dry_run):
+            print(f"  {s['ds']}: {s['status']} ({s['sources']} sources)")
@@ -0,0 +1,99 @@
+"""
+Run manifests: the list of raw objects a task wrote, stored in MinIO.
+
+Airflow tasks pass only the manifest key through XCom instead of the full
+{city: [s3_uri, ...]} dict, so the metadata DB stays small however many
+objects a run touches. A manifest is gzip-compressed JSON Lines, one entry
+per object:
+
+    {"city": "Warsaw", "uri": "s3://raw/weather/...", "rows": 1, "md5": "...",
+     "written": true}
+
+Objects that were already in the lake unchanged are listed too (written
+false): being in the lake does not mean they reached Postgres, so the loader
+decides what to skip from staging._ingest_log (see
+load_to_postgres.load_manifest, which streams a manifest into Postgres).
+
+The load task deletes its run's manifest once the load succeeded
+(delete_manifest); manifests of runs that never load stay behind, so an expiry
+rule on the _manifests/runs/ prefix is worth adding (see the README).
+"""
+
+import io
+import gzip
+import json
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+try:
+    from ingestion.extractor.s3_writer import get_s3_client
+except ModuleNotFoundError:  # run as a script from ingestion/extractor/
+    from s3_writer import get_s3_client
+
+MANIFEST_PREFIX = "_manifests/runs"
+
+
+def manifest_entry(city: str, bucket: str, result) -> dict:
+    """Manifest entry for a s3_writer.RawWrite result."""
+    return {
+        "city": city,
+        "uri": f"s3://{bucket}/{result.key}",
+        "rows": result.rows,
+        "md5": result.md5,
+        "written": result.written,
+    }
+
+
+def write_manifest(bucket: str, name: str, entries: Iterable[dict]) -> str:
+    """
+    Write entries as a manifest object.
+
+    Args:
+        bucket: S3 bucket name
+        name: Manifest path under MANIFEST_PREFIX, e.g. "etl_openmeteo/<run_id>/Warsaw"
+        entries: Dicts with at least city and uri
+
+    Returns:
+        S3 key of the manifest
+    """
+    key = f"{MANIFEST_PREFIX}/{name}.jsonl.gz"
+    lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+    get_s3_client().put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=io.BytesIO(gzip.compress(lines.encode(), mtime=0)),
+        ContentType="application/x-ndjson",
+        ContentEncoding="gzip",
+    )
+    return key
+
+
+def iter_manifest(bucket: str, key: str) -> Iterator[dict]:
+    """Stream the entries of a manifest without reading it into memory first."""
+    body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+    with gzip.GzipFile(fileobj=body) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def manifest_uris(
+    bucket: str, key: str, written_only: bool = False
+) -> dict[str, list[str]]:
+    """
+    Group a manifest's URIs by city, the shape validate/load functions take.
+
+    written_only drops objects that were already in the lake unchanged, e.g.
+    for validation: they passed it when they were first written.
+    """
+    uris = defaultdict(list)
+    for entry in iter_manifest(bucket, key):
+        if written_only and not entry.get("written", True):
+            continue
+        uris[entry["city"]].append(entry["uri"])
+    return dict(uris)
+
+
+def delete_manifest(bucket: str, key: str) -> None:
+    """Delete a manifest whose objects have been loaded."""
+    get_s3_client().delete_object(Bucket=bucket, Key=key)
@@ -1,5 +1,12 @@
+import os
+import math
+import time
+import random
+import threading
 import requests
 import datetime as dt
+from typing import Callable, Iterator
+from requests.adapters import HTTPAdapter
 
 BASE_URL = "https://api.open-meteo.com/v1/forecast"
 ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
@@ -8,9 +15,169 @@ PARAMS = {
     "hourly": "temperature_2m,precipitation,wind_speed_10m",
 }
 
+# Retry policy for transient failures (rate limiting and server errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.getenv("OPENMETEO_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("OPENMETEO_BACKOFF_BASE", "0.5"))  # seconds
+BACKOFF_MAX = float(os.getenv("OPENMETEO_BACKOFF_MAX", "30"))  # seconds
+POOL_SIZE = int(os.getenv("OPENMETEO_POOL_SIZE", "32"))
+# Largest window (days) requested from the Archive API in a single call
+ARCHIVE_MAX_DAYS = int(os.getenv("OPENMETEO_ARCHIVE_MAX_DAYS", "366"))
+# Largest window (days) requested from the forecast API in a single call
+FORECAST_MAX_DAYS = int(os.getenv("OPENMETEO_FORECAST_MAX_DAYS", "92"))
+# Open-Meteo bills a request spanning more than this many days as several
+# API calls (one per started block)
+BILLED_DAYS_PER_CALL = 14
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiter with per-minute/hour/day budgets.
+
+    acquire() blocks until every configured bucket has enough tokens. Buckets
+    start full and refill continuously, so short bursts up to a bucket's size
+    are allowed; once the daily bucket is drained, requests are paced at the
+    daily rate.
+
+    The state is per process: every Airflow task (and every script run) has
+    its own buckets, so N concurrent tasks can send N times the budget. The
+    daily cap still bounds a single long-running process (an archive backfill,
+    fetch_october_2025.py); set the limits to each process's share of the
+    quota.
+    """
+
+    def __init__(
+        self,
+        per_minute: float | None = None,
+        per_hour: float | None = None,
+        per_day: float | None = None,
+    ):
+        # (capacity, refill per second) for every configured window
+        self._buckets = [
+            (limit, limit / period)
+            for limit, period in ((per_minute, 60), (per_hour, 3600), (per_day, 86400))
+            if limit
+        ]
+        self._tokens = [capacity for capacity, _ in self._buckets]
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, weight: float = 1.0) -> None:
+        """Block until `weight` requests may be sent, then consume them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self._updated = now
+                wait = 0.0
+                for i, (capacity, rate) in enumerate(self._buckets):
+                    self._tokens[i] = min(capacity, self._tokens[i] + elapsed * rate)
+                    need = min(weight, capacity)  # never wait for the impossible
+                    wait = max(wait, (need - self._tokens[i]) / rate)
+                if wait <= 0:
+                    for i, (capacity, _) in enumerate(self._buckets):
+                        self._tokens[i] -= min(weight, capacity)
+                    return
+            time.sleep(wait)
+
+
+def _env_rate(name: str, default: str) -> float | None:
+    # 0 (or empty) disables that window
+    return float(os.getenv(name, default) or 0) or None
+
+
+# Open-Meteo free tier: 600/minute, 5000/hour, 10000/day (per process, see above)
+LIMITER = RateLimiter(
+    per_minute=_env_rate("OPENMETEO_RATE_PER_MINUTE", "600"),
+    per_hour=_env_rate("OPENMETEO_RATE_PER_HOUR", "5000"),
+    per_day=_env_rate("OPENMETEO_RATE_PER_DAY", "10000"),
+)
+
+
+def get_session() -> requests.Session:
+    """
+    Return the shared HTTP session, creating it on first use.
+
+    The session keeps connections alive across calls (one TCP+TLS handshake per
+    pooled connection instead of per request) and asks for gzip responses.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            _SESSION = session
+        return _SESSION
+
+
+def set_session(session: requests.Session | None) -> None:
+    """Replace the shared session (e.g. with a preconfigured or mocked one)."""
+    global _SESSION
+    with _SESSION_LOCK:
+        _SESSION = session
+
+
+def range_weight(start_date: str, end_date: str) -> int:
+    """Number of API calls one location over [start_date, end_date] is billed as."""
+    days = (
+        dt.date.fromisoformat(end_date) - dt.date.fromisoformat(start_date)
+    ).days + 1
+    return max(1, math.ceil(days / BILLED_DAYS_PER_CALL))
+
+
+def _backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    # Honour an explicit Retry-After (seconds) from the server when present
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    # "Full jitter" exponential backoff: spreads concurrent retries apart
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def _get(
+    url: str,
+    params: dict,
+    session: requests.Session | None = None,
+    weight: float = 1.0,
+) -> dict:
+    """
+    GET url and return the decoded JSON, retrying 429/5xx and connection errors.
+
+    Every attempt is paced by LIMITER; weight is the number of API calls the
+    request is billed as (Open-Meteo counts each location of a multi-location
+    request separately, and each started 14 days of a long range, see
+    range_weight).
+    """
+    session = session or get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        LIMITER.acquire(weight)
+        try:
+            r = session.get(url, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_backoff_delay(attempt))
+            continue
+
+        if r.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            time.sleep(_backoff_delay(attempt, r.headers.get("Retry-After")))
+            continue
+
+        r.raise_for_status()
+        return r.json()
+
 
 def fetch_hourly_data(
-    latitude: float, longitude: float, start_iso: str, end_iso: str
+    latitude: float,
+    longitude: float,
+    start_iso: str,
+    end_iso: str,
+    session: requests.Session | None = None,
 ) -> dict:
     # Parse dates and format for API (YYYY-MM-DD)
     start = dt.datetime.fromisoformat(start_iso)
@@ -23,9 +190,70 @@ def fetch_hourly_data(
         "start_date": start.strftime("%Y-%m-%d"),
         "end_date": end.strftime("%Y-%m-%d"),
     }
-    r = requests.get(BASE_URL, params=params, timeout=30)
-    r.raise_for_status()
-    return r.json()
+    return _get(BASE_URL, params, session)
+
+
+def _fetch_multi(
+    url: str,
+    params: dict,
+    locations: list[tuple[float, float]],
+    chunk_size: int,
+    session: requests.Session | None = None,
+) -> list[dict]:
+    """
+    Request many coordinates per call and split the response per location.
+
+    Open-Meteo takes comma-separated latitude/longitude lists and answers with
+    a list of results in the same order (a bare object for a single location).
+    """
+    payloads = []
+    for i in range(0, len(locations), chunk_size):
+        chunk = locations[i : i + chunk_size]
+        chunk_params = params | {
+            "latitude": ",".join(str(lat) for lat, _ in chunk),
+            "longitude": ",".join(str(lon) for _, lon in chunk),
+        }
+        weight = len(chunk) * range_weight(params["start_date"], params["end_date"])
+        data = _get(url, chunk_params, session, weight=weight)
+        if isinstance(data, dict):
+            data = [data]
+        if len(data) != len(chunk):
+            raise ValueError(
+                f"Expected {len(chunk)} locations in response, got {len(data)}"
+            )
+        payloads.extend(data)
+    return payloads
+
+
+def fetch_hourly_data_multi(
+    locations: list[tuple[float, float]],
+    start_iso: str,
+    end_iso: str,
+    chunk_size: int = 100,
+    session: requests.Session | None = None,
+) -> list[dict]:
+    """
+    Fetch hourly data for many locations in as few requests as possible.
+
+    Args:
+        locations: List of (latitude, longitude) pairs
+        start_iso: Window start as ISO datetime
+        end_iso: Window end as ISO datetime
+        chunk_size: Max locations per request (keeps URLs at a sane length)
+        session: HTTP session to use (default: shared pooled session)
+
+    Returns:
+        One payload per location, in the same order as locations; each has the
+        same shape as fetch_hourly_data's result
+    """
+    start = dt.datetime.fromisoformat(start_iso)
+    end = dt.datetime.fromisoformat(end_iso)
+
+    params = PARAMS | {
+        "start_date": start.strftime("%Y-%m-%d"),
+        "end_date": end.strftime("%Y-%m-%d"),
+    }
+    return _fetch_multi(BASE_URL, params, list(locations), chunk_size, session)
 
 
 def fetch_archive_data(
@@ -34,6 +262,7 @@ def fetch_archive_data(
     start_date: str,
     end_date: str,
     timezone: str = "auto",
+    session: requests.Session | None = None,
 ) -> dict:
     """
     Fetch historical data from the Archive API.
@@ -44,6 +273,7 @@ def fetch_archive_data(
         start_date: Start date in YYYY-MM-DD format
         end_date: End date in YYYY-MM-DD format (inclusive)
         timezone: Timezone (default: auto)
+        session: HTTP session to use (default: shared pooled session)
 
     Returns:
         JSON response from Archive API
@@ -56,6 +286,188 @@ def fetch_archive_data(
         "timezone": timezone,
         "hourly": "temperature_2m,precipitation,wind_speed_10m",
     }
-    r = requests.get(ARCHIVE_URL, params=params, timeout=30)
-    r.raise_for_status()
-    return r.json()
+    return _get(ARCHIVE_URL, params, session, weight=range_weight(start_date, end_date))
+
+
+def _window_too_large(exc: Exception) -> bool:
+    # errors a smaller window may avoid: 4xx other than 429 (e.g. a range the
+    # API rejects), timeouts and undecodable bodies of huge responses. 429,
+    # 5xx and connection errors were already retried by _get and would fail
+    # the same way for every half, so they are not worth splitting.
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return 400 <= status < 500 and status != 429
+    if isinstance(exc, requests.ConnectionError):
+        return False
+    return isinstance(exc, (requests.Timeout, ValueError))
+
+
+def coalesce_windows(
+    ranges: list[tuple[dt.datetime, dt.datetime]],
+    max_days: int = FORECAST_MAX_DAYS,
+) -> list[tuple[dt.date, dt.date]]:
+    """
+    Turn [start, end) hour ranges into the fewest day windows to request.
+
+    The API returns whole days, so ranges whose days overlap or touch share
+    a window; windows longer than max_days are split. Ranges far apart stay
+    separate requests, so fetched days scale with the gaps, not the span.
+
+    Returns:
+        Sorted (start_date, end_date) pairs, both inclusive
+    """
+    windows = []
+    for start, end in sorted(ranges):
+        first, last = start.date(), (end - dt.timedelta(hours=1)).date()
+        if windows and first <= windows[-1][1] + dt.timedelta(days=1):
+            windows[-1][1] = max(windows[-1][1], last)
+        else:
+            windows.append([first, last])
+
+    bounded = []
+    for first, last in windows:
+        while first <= last:
+            window_end = min(last, first + dt.timedelta(days=max_days - 1))
+            bounded.append((first, window_end))
+            first = window_end + dt.timedelta(days=1)
+    return bounded
+
+
+def merge_hourly_payloads(payloads: list[dict]) -> dict:
+    """
+    Concatenate the hourly arrays of consecutive payloads for one location.
+
+    Location metadata is taken from the first non-empty payload.
+    """
+    fields = ("time", "temperature_2m", "precipitation", "wind_speed_10m")
+    merged = {"hourly": {f: [] for f in fields}}
+    for payload in payloads:
+        hourly = payload.get("hourly") or {}
+        times = hourly.get("time") or []
+        if not times:
+            continue
+        for key in ("latitude", "longitude", "timezone"):
+            merged.setdefault(key, payload.get(key))
+        for f in fields:
+            values = hourly.get(f) or []
+            # pad short arrays so the columns stay aligned with time
+            merged["hourly"][f].extend(values + [None] * (len(times) - len(values)))
+    return merged
+
+
+def fetch_archive_range(
+    latitude: float,
+    longitude: float,
+    start_date: str,
+    end_date: str,
+    timezone: str = "auto",
+    max_days: int = ARCHIVE_MAX_DAYS,
+    min_days: int = 1,
+    failed: list | None = None,
+    session: requests.Session | None = None,
+) -> dict:
+    """
+    Fetch a historical date range in as few Archive API calls as possible.
+
+    The range is requested in windows of up to max_days. A window that fails
+    in a way a smaller window may avoid (a 4xx other than 429, a timeout, an
+    undecodable body) is split in half and retried, down to min_days. Rate
+    limiting, server and connection errors are not split: they are raised, or
+    recorded in failed.
+
+    Args:
+        latitude: Location latitude
+        longitude: Location longitude
+        start_date: Start date in YYYY-MM-DD format
+        end_date: End date in YYYY-MM-DD format (inclusive)
+        timezone: Timezone (default: auto)
+        max_days: Largest window per request
+        min_days: Smallest window worth retrying on its own
+        failed: If given, windows that still fail are appended to it as
+            (start_date, end_date) pairs instead of raising
+        session: HTTP session to use (default: shared pooled session)
+
+    Returns:
+        One payload covering every window that succeeded, same shape as
+        fetch_archive_data's result
+    """
+    payloads = []
+
+    def fetch_window(start: dt.date, end: dt.date):
+        try:
+            payloads.append(
+                fetch_archive_data(
+                    latitude,
+                    longitude,
+                    start.isoformat(),
+                    end.isoformat(),
+                    timezone=timezone,
+                    session=session,
+                )
+            )
+        except (requests.RequestException, ValueError) as exc:
+            days = (end - start).days + 1
+            if days > min_days and _window_too_large(exc):
+                mid = start + dt.timedelta(days=days // 2 - 1)
+                fetch_window(start, mid)
+                fetch_window(mid + dt.timedelta(days=1), end)
+            elif failed is not None:
+                failed.append((start, end))
+            else:
+                raise
+
+    start = dt.date.fromisoformat(start_date)
+    end = dt.date.fromisoformat(end_date)
+    while start <= end:
+        window_end = min(end, start + dt.timedelta(days=max_days - 1))
+        fetch_window(start, window_end)
+        start = window_end + dt.timedelta(days=1)
+
+    return merge_hourly_payloads(payloads)
+
+
+def split_payload(
+    payload: dict,
+    by: str = "hour",
+    keep: Callable[[dt.datetime], bool] | None = None,
+) -> Iterator[tuple[dt.datetime, dict]]:
+    """
+    Split an API payload into per-hour or per-day payloads.
+
+    Args:
+        payload: Response of any fetch_* function (one location)
+        by: "hour" for single-hour payloads, "day" for one payload per calendar day
+        keep: Optional filter on each hour's timestamp; rejected hours are dropped
+
+    Yields:
+        (partition, sub_payload) pairs; partition is the hour (or midnight of
+        the day), naive unless the API returned an explicit offset
+    """
+    hourly = payload.get("hourly", {})
+    times = hourly.get("time", [])
+    temps = hourly.get("temperature_2m", [])
+    precips = hourly.get("precipitation", [])
+    winds = hourly.get("wind_speed_10m", [])
+
+    groups = {}  # partition -> indices into the hourly arrays, in order
+    for i, time_str in enumerate(times):
+        hour_dt = dt.datetime.fromisoformat(time_str.replace("Z", "+00:00"))
+        if keep and not keep(hour_dt):
+            continue
+        partition = hour_dt if by == "hour" else hour_dt.replace(hour=0)
+        groups.setdefault(partition, []).append(i)
+
+    for partition, idx in groups.items():
+        yield partition, {
+            "latitude": payload.get("latitude"),
+            "longitude": payload.get("longitude"),
+            "timezone": payload.get("timezone"),
+            "hourly": {
+                "time": [times[i] for i in idx],
+                "temperature_2m": [temps[i] if i < len(temps) else None for i in idx],
+                "precipitation": [
+                    precips[i] if i < len(precips) else None for i in idx
+                ],
+                "wind_speed_10m": [winds[i] if i < len(winds) else None for i in idx],
+            },
+        }
@@ -1,9 +1,12 @@
 import json
 import io
+import gzip
+import hashlib
 import datetime as dt
-import boto3
 import os
-from botocore.config import Config
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
 
 
 def _resolve_endpoint() -> str:
@@ -18,17 +21,434 @@ def _resolve_endpoint() -> str:
     return ep
 
 
-ENDPOINT = _resolve_endpoint()
-# print(f"[s3_writer] Using S3 endpoint: {ENDPOINT}")
+# What write_raw does when the object key already exists: "overwrite",
+# "skip" (keep the existing object) or "if-changed" (write only if the
+# content differs); see write_raw
+RAW_ON_CONFLICT = os.getenv("RAW_ON_CONFLICT", "if-changed")
+ON_CONFLICT_POLICIES = ("overwrite", "skip", "if-changed")
 
-S3 = boto3.client(
-    "s3",
-    endpoint_url=ENDPOINT,
-    aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
-    aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD"),
-    region_name=os.getenv("MINIO_REGION", "us-east-1"),
-    config=Config(s3={"addressing_style": "path"}),
-)
+# Connection pool per client; keep >= the number of threads sharing it
+S3_POOL_SIZE = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+
+_S3 = None
+_S3_LOCK = threading.Lock()
+
+
+def new_s3_client():
+    """
+    Build a boto3 S3 client for MinIO. boto3 is imported here so importing
+    this module stays cheap; most callers want get_s3_client() instead.
+    """
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=_resolve_endpoint(),
+        aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
+        aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD"),
+        region_name=os.getenv("MINIO_REGION", "us-east-1"),
+        config=Config(
+            s3={"addressing_style": "path"},
+            max_pool_connections=S3_POOL_SIZE,
+            retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+            connect_timeout=5,
+            read_timeout=60,
+        ),
+    )
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client, creating it on first use.
+
+    boto3 clients are thread-safe, so worker threads share this one client
+    (and its connection pool).
+    """
+    global _S3
+    if _S3 is None:
+        with _S3_LOCK:
+            if _S3 is None:
+                _S3 = new_s3_client()
+    return _S3
+
+
+def set_s3_client(client) -> None:
+    """Replace the shared client (e.g. with a differently configured one)."""
+    global _S3
+    with _S3_LOCK:
+        _S3 = client
+
+
+def discover_cities(bucket: str, base_prefix: str = "weather/", s3=None) -> list[str]:
+    """Discover city folders in the lake by listing prefixes under base_prefix."""
+    base_prefix = base_prefix.rstrip("/") + "/"
+    s3 = s3 or get_s3_client()
+
+    cities = set()
+    paginator = s3.get_paginator("list_objects_v2")
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=base_prefix, Delimiter="/"):
+        # CommonPrefixes gives us the "folders"
+        for prefix_info in page.get("CommonPrefixes", []):
+            # Extract city name: "weather/Warsaw/" -> "Warsaw"
+            city = prefix_info["Prefix"][len(base_prefix) :].strip("/")
+            if city:
+                cities.add(city)
+
+    return sorted(cities)
+
+
+# "hour": one object per hour under ds=/hour=; "day": one object per day (or
+# per fetch window within a day) directly under ds=
+RAW_LAYOUT = os.getenv("RAW_LAYOUT", "hour")
+# "json" or "parquet" (needs pyarrow)
+RAW_FORMAT = os.getenv("RAW_FORMAT", "json")
+# JSON objects only: "", "gzip" or "zstd" (needs zstandard); Parquet already
+# compresses its columns
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION", "")
+
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+HOURLY_FIELDS = ("temperature_2m", "precipitation", "wind_speed_10m")
+
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd raw objects need zstandard: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        # mtime=0 keeps the output (and so the ETag) stable for equal payloads
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return _import_zstd().ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unsupported compression: {compression!r}")
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _import_zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported compression: {compression!r}")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet raw objects need pyarrow: pip install pyarrow"
+        ) from e
+    return pa, pc, pq
+
+
+def _encode_parquet(payload: dict) -> bytes:
+    """
+    Encode a payload as a Parquet table: one row per hour with a typed time
+    column and float64 measurements; location fields go in the schema metadata.
+    """
+    pa, pc, pq = _import_pyarrow()
+    hourly = payload.get("hourly") or {}
+    times = pa.array(hourly.get("time") or [], pa.string())
+    columns = {"time": pc.strptime(times, format="%Y-%m-%dT%H:%M", unit="s")}
+    for field in HOURLY_FIELDS:
+        values = list(hourly.get(field) or [])
+        values += [None] * (len(times) - len(values))
+        columns[field] = pa.array(values[: len(times)], pa.float64())
+
+    metadata = {
+        key: json.dumps(payload.get(key))
+        for key in ("latitude", "longitude", "timezone")
+    }
+    table = pa.table(columns).replace_schema_metadata(metadata)
+    buf = io.BytesIO()
+    pq.write_table(table, buf)
+    return buf.getvalue()
+
+
+def _decode_parquet(data: bytes) -> dict:
+    """Inverse of _encode_parquet; returns the usual payload dict shape."""
+    pa, pc, pq = _import_pyarrow()
+    table = pq.read_table(pa.BufferReader(data))
+    metadata = table.schema.metadata or {}
+    payload = {
+        key: json.loads(metadata[key.encode()])
+        for key in ("latitude", "longitude", "timezone")
+        if key.encode() in metadata
+    }
+    # whole-column conversions, no per-record parsing
+    hourly = {"time": pc.strftime(table["time"], format="%Y-%m-%dT%H:%M").to_pylist()}
+    for field in HOURLY_FIELDS:
+        hourly[field] = table[field].to_pylist()
+    payload["hourly"] = hourly
+    return payload
+
+
+def raw_extension(fmt: str = None, compression: str = None) -> str:
+    """File extension for a raw object, e.g. "json", "json.gz" or "parquet"."""
+    if (fmt or RAW_FORMAT) == "parquet":
+        return "parquet"
+    compression = RAW_COMPRESSION if compression is None else compression
+    return "json" + COMPRESSION_SUFFIXES.get(compression, "")
+
+
+def encode_raw(payload: dict, fmt: str = None, compression: str = None):
+    """
+    Serialize a payload the way write_raw stores it.
+
+    Returns:
+        (body bytes, dict of ContentType/ContentEncoding for put_object)
+    """
+    if (fmt or RAW_FORMAT) == "parquet":
+        return _encode_parquet(payload), {"ContentType": PARQUET_CONTENT_TYPE}
+
+    compression = RAW_COMPRESSION if compression is None else compression
+    data = json.dumps(payload).encode()
+    headers = {"ContentType": "application/json"}
+    if compression:
+        data = _compress(data, compression)
+        headers["ContentEncoding"] = compression
+    return data, headers
+
+
+def read_raw(bucket: str, key: str, s3=None) -> dict:
+    """
+    Read a raw object written by write_raw back into a payload dict.
+
+    JSON and Parquet objects are both supported, detected from the key suffix
+    or the stored content type; gzip/zstd-encoded objects are decompressed
+    first.
+
+    Args:
+        bucket: S3 bucket name
+        key: Object key
+        s3: Optional boto3 client (defaults to get_s3_client())
+
+    Returns:
+        Payload dict with latitude/longitude/timezone and hourly arrays
+    """
+    obj = (s3 or get_s3_client()).get_object(Bucket=bucket, Key=key)
+    data = obj["Body"].read()
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if obj.get("ContentEncoding") == compression or key.endswith(suffix):
+            data = _decompress(data, compression)
+            key = key.removesuffix(suffix)
+            break
+    if key.endswith(".parquet") or obj.get("ContentType") == PARQUET_CONTENT_TYPE:
+        return _decode_parquet(data)
+    return json.loads(data)
+
+
+def raw_key(
+    prefix: str,
+    city: str,
+    partition_dt: dt.datetime,
+    layout: str,
+    ext: str,
+    first_hour: str,
+    last_hour: str,
+) -> str:
+    """
+    Deterministic key of a raw object: the same city, hour (or hour range for
+    the day layout) and format always map to the same key.
+    """
+    base = f"{prefix}/{city}" if city else prefix
+    if layout == "day":
+        hours = f"h{first_hour[11:13]}-{last_hour[11:13]}"
+        return f"{base}/ds={partition_dt:%Y-%m-%d}/openmeteo_{partition_dt:%Y%m%d}_{hours}.{ext}"
+    return f"{base}/ds={partition_dt:%Y-%m-%d}/hour={partition_dt:%H}/openmeteo_{partition_dt:%Y%m%dT%H}.{ext}"
+
+
+def _head_object(bucket: str, key: str) -> dict | None:
+    """head_object, or None if the key does not exist."""
+    from botocore.exceptions import ClientError
+
+    try:
+        return get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def stored_md5(head: dict) -> str:
+    """Content MD5 recorded by write_raw, falling back to the (single-part) ETag."""
+    return (head.get("Metadata") or {}).get("content-md5") or (
+        head.get("ETag") or ""
+    ).strip('"')
+
+
+class CoverageIndex:
+    """
+    Content MD5 of the raw objects already in the lake, keyed by object key.
+
+    Each ds= partition prefix is listed once, on first use, so checking many
+    hours of a city-day costs one LIST instead of one HEAD per object;
+    concurrent writers of the same city-day wait for that one listing. The
+    ETag of a single-part upload (all write_raw uploads are) is the MD5 of
+    its body, so it is compared directly with the new content.
+    """
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self._md5 = {}
+        self._listed = set()
+        self._lock = threading.Lock()
+        self._prefix_locks = {}  # prefix -> lock held while it is listed
+
+    def _list(self, prefix: str) -> None:
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        found = {}
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                found[obj["Key"]] = (obj.get("ETag") or "").strip('"')
+        with self._lock:
+            self._md5.update(found)
+            self._listed.add(prefix)
+
+    def get(self, key: str) -> str | None:
+        """MD5 of the object at key, or None if there is none."""
+        # list the whole ds=YYYY-MM-DD/ partition the key lives in
+        head, sep, tail = key.partition("/ds=")
+        prefix = f"{head}{sep}{tail.split('/', 1)[0]}/" if sep else key
+        if prefix not in self._listed:
+            with self._lock:
+                prefix_lock = self._prefix_locks.setdefault(prefix, threading.Lock())
+            # one thread lists the partition; the others wait for its result
+            with prefix_lock:
+                if prefix not in self._listed:
+                    self._list(prefix)
+        return self._md5.get(key)
+
+    def add(self, key: str, md5: str) -> None:
+        with self._lock:
+            self._md5[key] = md5
+
+
+class PreparedRaw(NamedTuple):
+    """
+    A payload encoded for upload and checked against the lake: existing_md5
+    is set when the object already there is kept (nothing to upload).
+    """
+
+    key: str
+    data: bytes
+    headers: dict
+    metadata: dict
+    md5: str
+    existing_md5: str | None
+    rows: int
+
+
+def _prepare_raw(
+    bucket: str,
+    prefix: str,
+    payload: dict,
+    city: str = None,
+    partition_dt: dt.datetime = None,
+    layout: str = None,
+    fmt: str = None,
+    compression: str = None,
+    on_conflict: str = None,
+    coverage: CoverageIndex = None,
+) -> PreparedRaw:
+    """Encode payload and decide whether it must be uploaded (see write_raw)."""
+    on_conflict = on_conflict or RAW_ON_CONFLICT
+    if on_conflict not in ON_CONFLICT_POLICIES:
+        raise ValueError(f"Unsupported on_conflict policy: {on_conflict!r}")
+
+    ingest_ts = dt.datetime.now(dt.UTC).replace(tzinfo=None)
+    # Use provided partition date or default to now
+    partition_date = partition_dt or ingest_ts
+    layout = layout or RAW_LAYOUT
+    ext = raw_extension(fmt, compression)
+
+    # first/last hour covered by the payload, kept as object metadata
+    times = (payload.get("hourly") or {}).get("time") or []
+    first_hour = times[0] if times else f"{partition_date:%Y-%m-%dT%H:00}"
+    last_hour = times[-1] if times else first_hour
+
+    key = raw_key(prefix, city, partition_date, layout, ext, first_hour, last_hour)
+    data, headers = encode_raw(payload, fmt, compression)
+    md5 = hashlib.md5(data).hexdigest()
+    metadata = {
+        "hour-start": first_hour,
+        "hour-end": last_hour,
+        "content-md5": md5,
+        "ingested-at": f"{ingest_ts:%Y-%m-%dT%H:%M:%S}",
+    }
+
+    existing_md5 = None
+    if on_conflict != "overwrite":
+        if coverage is not None:
+            existing_md5 = coverage.get(key)
+        else:
+            existing = _head_object(bucket, key)
+            existing_md5 = stored_md5(existing) if existing is not None else None
+        if on_conflict != "skip" and existing_md5 != md5:
+            existing_md5 = None  # missing or changed: upload
+    return PreparedRaw(key, data, headers, metadata, md5, existing_md5, len(times))
+
+
+def _put_raw(
+    bucket: str, prepared: PreparedRaw, coverage: CoverageIndex = None
+) -> None:
+    get_s3_client().put_object(
+        Bucket=bucket,
+        Key=prepared.key,
+        Body=io.BytesIO(prepared.data),
+        **prepared.headers,
+        Metadata=prepared.metadata,
+    )
+    if coverage is not None:
+        coverage.add(prepared.key, prepared.md5)
+
+
+def _write_raw(
+    bucket: str,
+    prefix: str,
+    payload: dict,
+    city: str = None,
+    partition_dt: dt.datetime = None,
+    layout: str = None,
+    fmt: str = None,
+    compression: str = None,
+    on_conflict: str = None,
+    coverage: CoverageIndex = None,
+) -> tuple[str, bool, str]:
+    """
+    write_raw, also returning whether the object was actually uploaded and
+    the content MD5 of the object now stored at the key.
+    """
+    prepared = _prepare_raw(
+        bucket,
+        prefix,
+        payload,
+        city,
+        partition_dt,
+        layout,
+        fmt,
+        compression,
+        on_conflict,
+        coverage,
+    )
+    if prepared.existing_md5 is not None:
+        return prepared.key, False, prepared.existing_md5
+    _put_raw(bucket, prepared, coverage)
+    return prepared.key, True, prepared.md5
 
 
 def write_raw(
@@ -37,9 +457,17 @@ def write_raw(
     payload: dict,
     city: str = None,
     partition_dt: dt.datetime = None,
+    layout: str = None,
+    fmt: str = None,
+    compression: str = None,
+    on_conflict: str = None,
+    coverage: CoverageIndex = None,
 ) -> str:
     """
-    Write raw JSON payload to S3/MinIO.
+    Write raw payload to S3/MinIO as JSON or Parquet.
+
+    Keys are deterministic (see raw_key), so re-running an extract targets
+    the same objects instead of adding duplicates next to them.
 
     Args:
         bucket: S3 bucket name
@@ -47,21 +475,130 @@ def write_raw(
         payload: JSON payload to write
         city: City name (creates city subfolder if provided)
         partition_dt: Date to use for partitioning (defaults to now for backwards compatibility)
+        layout: "hour" (ds=/hour=/ partitions) or "day" (ds=/ only, the key and
+            object metadata record the hour range); defaults to RAW_LAYOUT
+        fmt: "json" or "parquet"; defaults to RAW_FORMAT
+        compression: "", "gzip" or "zstd" for JSON objects; defaults to
+            RAW_COMPRESSION
+        on_conflict: If the key exists: "overwrite", "skip" it, or write only
+            "if-changed" (compares the stored content MD5); defaults to
+            RAW_ON_CONFLICT
+        coverage: Optional CoverageIndex to check existing objects against
+            instead of one HEAD request per write
 
     Returns:
-        S3 key of written object
+        S3 key of the object (also when an existing one was kept)
     """
-    # Use provided partition date or default to now
-    partition_date = partition_dt or dt.datetime.utcnow()
-    ingest_ts = dt.datetime.utcnow()
+    key, _, _ = _write_raw(
+        bucket,
+        prefix,
+        payload,
+        city,
+        partition_dt,
+        layout,
+        fmt,
+        compression,
+        on_conflict,
+        coverage,
+    )
+    return key
 
-    if city:
-        key = f"{prefix}/{city}/ds={partition_date:%Y-%m-%d}/hour={partition_date:%H}/openmeteo_{ingest_ts:%Y%m%dT%H%M%S}.json"
-    else:
-        key = f"{prefix}/ds={partition_date:%Y-%m-%d}/hour={partition_date:%H}/openmeteo_{ingest_ts:%Y%m%dT%H%M%S}.json"
 
-    data = json.dumps(payload).encode()
-    S3.put_object(
-        Bucket=bucket, Key=key, Body=io.BytesIO(data), ContentType="application/json"
+class RawWrite(NamedTuple):
+    """
+    Outcome of one write_raw_many item: the key (written is False if an
+    existing object was kept) with its content MD5 and hour count, or the
+    error it raised.
+    """
+
+    key: str | None
+    error: Exception | None = None
+    written: bool = False
+    md5: str | None = None
+    rows: int = 0
+
+
+def prepare_raw_item(
+    bucket: str,
+    prefix: str,
+    item: tuple[str, dt.datetime, dict],
+    **write_kwargs,
+) -> PreparedRaw:
+    """
+    Encode one (city, partition_dt, payload) item and check it against the
+    lake without uploading it, so callers can act on changed items only
+    (e.g. validate them) before upload_prepared.
+    """
+    city, partition_dt, payload = item
+    return _prepare_raw(
+        bucket, prefix, payload, city=city, partition_dt=partition_dt, **write_kwargs
     )
-    return key
+
+
+def upload_prepared(
+    bucket: str, prepared: PreparedRaw, coverage: CoverageIndex = None
+) -> RawWrite:
+    """
+    Upload a prepared item unless the existing object is kept; errors are
+    returned in the RawWrite instead of raised.
+    """
+    if prepared.existing_md5 is not None:
+        return RawWrite(prepared.key, md5=prepared.existing_md5, rows=prepared.rows)
+    try:
+        _put_raw(bucket, prepared, coverage)
+    except Exception as e:
+        return RawWrite(None, e)
+    return RawWrite(prepared.key, written=True, md5=prepared.md5, rows=prepared.rows)
+
+
+def write_raw_item(
+    bucket: str,
+    prefix: str,
+    item: tuple[str, dt.datetime, dict],
+    **write_kwargs,
+) -> RawWrite:
+    """
+    Write one (city, partition_dt, payload) item; errors are returned in the
+    RawWrite instead of raised.
+    """
+    try:
+        prepared = prepare_raw_item(bucket, prefix, item, **write_kwargs)
+    except Exception as e:
+        return RawWrite(None, e)
+    return upload_prepared(bucket, prepared, write_kwargs.get("coverage"))
+
+
+def write_raw_many(
+    bucket: str,
+    prefix: str,
+    items: Iterable[tuple[str, dt.datetime, dict]],
+    max_workers: int = 16,
+    **write_kwargs,
+) -> list[RawWrite]:
+    """
+    Upload many payloads concurrently with write_raw.
+
+    A failed upload does not stop the others; check each result's error.
+
+    Args:
+        bucket: S3 bucket name
+        prefix: Key prefix (e.g., 'weather')
+        items: (city, partition_dt, payload) tuples
+        max_workers: Upload threads (capped at the S3 connection pool size)
+        **write_kwargs: layout/fmt/compression/on_conflict/coverage, passed
+            through to write_raw
+
+    Returns:
+        One RawWrite per item, in input order
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def _write(item) -> RawWrite:
+        return write_raw_item(bucket, prefix, item, **write_kwargs)
+
+    get_s3_client()  # create the shared client once, not in every thread
+    workers = max(1, min(max_workers, S3_POOL_SIZE, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_write, items))
@@ -0,0 +1,64 @@
+"""
+Tests for the asyncio extraction engine against a fake S3 client.
+"""
+
+from ingestion.extractor.async_extract import extract
+
+
+def _six_hours(temperature: float = 1.0) -> dict:
+    times = [f"2025-10-01T{h:02d}:00" for h in range(6)]
+    return {
+        "latitude": 52.23,
+        "longitude": 21.01,
+        "timezone": "GMT",
+        "hourly": {
+            "time": times,
+            "temperature_2m": [temperature] * 6,
+            "precipitation": [0.0] * 6,
+            "wind_speed_10m": [1.0] * 6,
+        },
+    }
+
+
+def _run(payload: dict):
+    validated = []
+    entries = []
+    extract(
+        [(["Warsaw"], lambda: [payload])],
+        layout="hour",
+        entries=entries,
+        validate=lambda pairs: validated.extend(pairs),
+    )
+    return validated, entries
+
+
+def test_unchanged_hours_are_not_validated_or_uploaded(fake_s3):
+    """A re-run with identical data lists the city-day once and writes nothing."""
+    fake_s3.list_delay = 0.01
+    validated, entries = _run(_six_hours())
+    assert len(validated) == 6
+    assert fake_s3.count("PutObject") == 6
+    assert fake_s3.count("ListObjectsV2") == 1
+    assert all(e["written"] for e in entries)
+
+    fake_s3.calls.clear()
+    validated, entries = _run(_six_hours())
+    assert validated == []
+    assert fake_s3.calls == ["ListObjectsV2"]
+    # unchanged objects stay in the manifest for the loader to decide
+    assert len(entries) == 6
+    assert not any(e["written"] for e in entries)
+
+
+def test_changed_hours_are_validated_and_uploaded(fake_s3):
+    """Only hours whose content changed are validated and written again."""
+    _run(_six_hours())
+    fake_s3.calls.clear()
+
+    changed = _six_hours()
+    changed["hourly"]["temperature_2m"][5] = 9.0
+    validated, entries = _run(changed)
+
+    assert [part["hourly"]["time"] for _, part in validated] == [["2025-10-01T05:00"]]
+    assert fake_s3.count("PutObject") == 1
+    assert [e["written"] for e in entries] == [False] * 5 + [True]
@@ -0,0 +1,56 @@
+"""
+Tests for merging raw payloads during compaction (no S3 access).
+"""
+
+from ingestion.extractor.compact_raw import _merge_payloads
+
+
+def _payload(times, temps, lat=52.23):
+    return {
+        "latitude": lat,
+        "longitude": 21.01,
+        "timezone": "Europe/Berlin",
+        "hourly": {
+            "time": times,
+            "temperature_2m": temps,
+            "precipitation": [0.0] * len(times),
+            "wind_speed_10m": [1.0] * len(times),
+        },
+    }
+
+
+def test_merge_payloads_sorts_hours():
+    """Hours from several objects end up in one time-sorted payload."""
+    merged = _merge_payloads(
+        [
+            _payload(["2025-10-01T02:00"], [3.0]),
+            _payload(["2025-10-01T00:00", "2025-10-01T01:00"], [1.0, 2.0]),
+        ]
+    )
+    assert merged["hourly"]["time"] == [
+        "2025-10-01T00:00",
+        "2025-10-01T01:00",
+        "2025-10-01T02:00",
+    ]
+    assert merged["hourly"]["temperature_2m"] == [1.0, 2.0, 3.0]
+
+
+def test_merge_payloads_later_payload_wins():
+    """An hour present in several objects takes the later object's values."""
+    merged = _merge_payloads(
+        [
+            _payload(["2025-10-01T00:00"], [1.0], lat=50.0),
+            _payload(["2025-10-01T00:00"], [9.0]),
+        ]
+    )
+    assert merged["hourly"]["time"] == ["2025-10-01T00:00"]
+    assert merged["hourly"]["temperature_2m"] == [9.0]
+    assert merged["latitude"] == 52.23
+
+
+def test_merge_payloads_pads_short_arrays():
+    """Missing values in a short array become None instead of shifting columns."""
+    payload = _payload(["2025-10-01T00:00", "2025-10-01T01:00"], [1.0])
+    merged = _merge_payloads([payload, {"hourly": {}}])
+    assert merged["hourly"]["temperature_2m"] == [1.0, None]
+    assert merged["hourly"]["wind_speed_10m"] == [1.0, 1.0]
@@ -0,0 +1,67 @@
+"""
+Tests for run manifests against a fake S3 client.
+"""
+
+import gzip
+import json
+
+from ingestion.extractor.manifest import (
+    MANIFEST_PREFIX,
+    delete_manifest,
+    iter_manifest,
+    manifest_uris,
+    write_manifest,
+)
+
+
+def _entry(city: str, hour: int, written: bool) -> dict:
+    uri = f"s3://raw/weather/{city}/ds=2025-10-01/hour={hour:02d}/a.json"
+    return {
+        "city": city,
+        "uri": uri,
+        "rows": 1,
+        "md5": f"md5-{hour}",
+        "written": written,
+    }
+
+
+def test_manifest_uris_written_only(fake_s3):
+    """written_only leaves out objects that were already in the lake unchanged."""
+    key = write_manifest(
+        "raw",
+        "etl_openmeteo/run/Warsaw",
+        [_entry("Warsaw", 0, False), _entry("Warsaw", 1, True)],
+    )
+    assert manifest_uris("raw", key, written_only=True) == {
+        "Warsaw": [_entry("Warsaw", 1, True)["uri"]]
+    }
+    assert len(manifest_uris("raw", key)["Warsaw"]) == 2
+
+
+def test_manifest_round_trip(fake_s3):
+    """Entries come back in order; URIs are grouped by city."""
+    entries = [_entry("Warsaw", 0, True), _entry("Berlin", 0, True)]
+    entries.append(_entry("Warsaw", 1, True))
+    key = write_manifest("raw", "backfill_openmeteo/run", entries)
+
+    assert key == f"{MANIFEST_PREFIX}/backfill_openmeteo/run.jsonl.gz"
+    assert list(iter_manifest("raw", key)) == entries
+    assert manifest_uris("raw", key) == {
+        "Warsaw": [entries[0]["uri"], entries[2]["uri"]],
+        "Berlin": [entries[1]["uri"]],
+    }
+    # gzip-compressed JSON Lines, readable without this module
+    body = fake_s3.objects[("raw", key)]["Body"]
+    assert json.loads(gzip.decompress(body).splitlines()[0]) == entries[0]
+
+
+def test_empty_manifest(fake_s3):
+    """A run without objects still gets a (readable, empty) manifest."""
+    key = write_manifest("raw", "etl_openmeteo/run/Warsaw", [])
+    assert manifest_uris("raw", key) == {}
+
+
+def test_delete_manifest(fake_s3):
+    key = write_manifest("raw", "etl_openmeteo/run/Warsaw", [_entry("Warsaw", 0, True)])
+    delete_manifest("raw", key)
+    assert ("raw", key) not in fake_s3.objects
@@ -0,0 +1,348 @@
+"""
+Tests for the pure helpers of the Open-Meteo client (no network access).
+"""
+
+import datetime as dt
+
+import pytest
+import requests
+
+from ingestion.extractor import openmeteo_client
+from ingestion.extractor.openmeteo_client import (
+    RateLimiter,
+    coalesce_windows,
+    fetch_archive_range,
+    fetch_hourly_data_multi,
+    range_weight,
+    split_payload,
+)
+
+PAYLOAD = {
+    "latitude": 52.23,
+    "longitude": 21.01,
+    "timezone": "Europe/Berlin",
+    "hourly": {
+        "time": ["2025-10-31T22:00", "2025-10-31T23:00", "2025-11-01T00:00"],
+        "temperature_2m": [1.0, 2.0, 3.0],
+        "precipitation": [0.0, 0.5],  # one value short
+        "wind_speed_10m": [4.0, 5.0, 6.0],
+    },
+}
+
+
+def _hours(start: str, end: str) -> tuple[dt.datetime, dt.datetime]:
+    return dt.datetime.fromisoformat(start), dt.datetime.fromisoformat(end)
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def _day_payload(start_date: str, end_date: str) -> dict:
+    first = dt.date.fromisoformat(start_date)
+    days = (dt.date.fromisoformat(end_date) - first).days + 1
+    times = [f"{first + dt.timedelta(days=d)}T00:00" for d in range(days)]
+    return {
+        "latitude": 1.0,
+        "longitude": 2.0,
+        "timezone": "GMT",
+        "hourly": {
+            "time": times,
+            "temperature_2m": [0.0] * days,
+            "precipitation": [0.0] * days,
+            "wind_speed_10m": [0.0] * days,
+        },
+    }
+
+
+def test_coalesce_windows_merges_touching_days():
+    """Ranges on the same or adjacent days share one window."""
+    ranges = [
+        _hours("2025-10-02T05:00", "2025-10-02T07:00"),
+        _hours("2025-10-01T10:00", "2025-10-02T00:00"),
+        _hours("2025-10-03T00:00", "2025-10-03T01:00"),
+    ]
+    assert coalesce_windows(ranges) == [(dt.date(2025, 10, 1), dt.date(2025, 10, 3))]
+
+
+def test_coalesce_windows_keeps_distant_ranges_apart():
+    """Ranges with a day in between are requested separately."""
+    ranges = [
+        _hours("2025-10-01T00:00", "2025-10-01T03:00"),
+        _hours("2025-10-05T00:00", "2025-10-05T03:00"),
+    ]
+    assert coalesce_windows(ranges) == [
+        (dt.date(2025, 10, 1), dt.date(2025, 10, 1)),
+        (dt.date(2025, 10, 5), dt.date(2025, 10, 5)),
+    ]
+
+
+def test_coalesce_windows_splits_long_windows():
+    """Windows longer than max_days are cut into max_days pieces."""
+    ranges = [_hours("2025-10-01T00:00", "2025-10-11T00:00")]
+    assert coalesce_windows(ranges, max_days=4) == [
+        (dt.date(2025, 10, 1), dt.date(2025, 10, 4)),
+        (dt.date(2025, 10, 5), dt.date(2025, 10, 8)),
+        (dt.date(2025, 10, 9), dt.date(2025, 10, 10)),
+    ]
+
+
+def test_split_payload_by_hour():
+    """One single-hour payload per timestamp; short arrays are padded."""
+    parts = list(split_payload(PAYLOAD))
+    assert [p for p, _ in parts] == [
+        dt.datetime(2025, 10, 31, 22),
+        dt.datetime(2025, 10, 31, 23),
+        dt.datetime(2025, 11, 1, 0),
+    ]
+    last = parts[-1][1]
+    assert last["latitude"] == 52.23
+    assert last["hourly"] == {
+        "time": ["2025-11-01T00:00"],
+        "temperature_2m": [3.0],
+        "precipitation": [None],
+        "wind_speed_10m": [6.0],
+    }
+
+
+def test_split_payload_by_day_with_filter():
+    """Day partitions group hours by date; rejected hours are dropped."""
+    parts = dict(split_payload(PAYLOAD, by="day", keep=lambda h: h.hour != 23))
+    assert list(parts) == [dt.datetime(2025, 10, 31), dt.datetime(2025, 11, 1)]
+    assert parts[dt.datetime(2025, 10, 31)]["hourly"]["time"] == ["2025-10-31T22:00"]
+
+
+def test_range_weight():
+    """Each started 14 days of a range is billed as one call."""
+    assert range_weight("2025-10-01", "2025-10-01") == 1
+    assert range_weight("2025-10-01", "2025-10-14") == 1
+    assert range_weight("2025-10-01", "2025-10-15") == 2
+    assert range_weight("2024-01-01", "2024-12-31") == 27
+
+
+def test_fetch_archive_range_splits_rejected_windows(monkeypatch):
+    """A window the API rejects (4xx) is halved until the pieces succeed."""
+    calls = []
+
+    def fake_fetch(lat, lon, start_date, end_date, timezone, session):
+        calls.append((start_date, end_date))
+        if start_date != end_date:
+            raise _http_error(400)
+        return _day_payload(start_date, end_date)
+
+    monkeypatch.setattr(openmeteo_client, "fetch_archive_data", fake_fetch)
+
+    merged = fetch_archive_range(1.0, 2.0, "2025-10-01", "2025-10-04")
+    assert merged["hourly"]["time"] == [
+        "2025-10-01T00:00",
+        "2025-10-02T00:00",
+        "2025-10-03T00:00",
+        "2025-10-04T00:00",
+    ]
+    assert calls[0] == ("2025-10-01", "2025-10-04")
+    assert len(calls) == 7
+
+
+def test_fetch_archive_range_records_failed_windows(monkeypatch):
+    """Windows still failing at min_days are reported through failed."""
+
+    def fake_fetch(lat, lon, start_date, end_date, timezone, session):
+        if start_date == "2025-10-02":
+            raise requests.Timeout("too slow")
+        return _day_payload(start_date, end_date)
+
+    monkeypatch.setattr(openmeteo_client, "fetch_archive_data", fake_fetch)
+
+    failed = []
+    merged = fetch_archive_range(
+        1.0, 2.0, "2025-10-01", "2025-10-02", max_days=1, failed=failed
+    )
+    assert merged["hourly"]["time"] == ["2025-10-01T00:00"]
+    assert failed == [(dt.date(2025, 10, 2), dt.date(2025, 10, 2))]
+
+
+@pytest.mark.parametrize(
+    "error", [_http_error(429), _http_error(503), requests.ConnectionError("down")]
+)
+def test_fetch_archive_range_does_not_split_rate_or_server_errors(monkeypatch, error):
+    """429, 5xx and connection errors are raised, not multiplied by splitting."""
+    calls = []
+
+    def fake_fetch(lat, lon, start_date, end_date, timezone, session):
+        calls.append((start_date, end_date))
+        raise error
+
+    monkeypatch.setattr(openmeteo_client, "fetch_archive_data", fake_fetch)
+
+    with pytest.raises(type(error)):
+        fetch_archive_range(1.0, 2.0, "2025-10-01", "2025-10-04")
+    assert calls == [("2025-10-01", "2025-10-04")]
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """Replace time.monotonic/sleep in the client; sleeping advances the clock."""
+    clock = {"now": 0.0, "sleeps": []}
+
+    def sleep(seconds):
+        clock["sleeps"].append(seconds)
+        # like a real sleep, always let some time pass (rounding can leave
+        # waits far below the clock's resolution)
+        clock["now"] += max(seconds, 1e-6)
+
+    monkeypatch.setattr(openmeteo_client.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(openmeteo_client.time, "sleep", sleep)
+    return clock
+
+
+def test_rate_limiter_allows_burst_then_waits(fake_clock):
+    """A full bucket serves a burst; the next request waits for a refill."""
+    limiter = RateLimiter(per_minute=60)
+    for _ in range(60):
+        limiter.acquire()
+    assert fake_clock["sleeps"] == []
+
+    limiter.acquire()
+    assert fake_clock["sleeps"] == [pytest.approx(1.0)]
+
+
+def test_rate_limiter_caps_weight_at_capacity(fake_clock):
+    """A request heavier than a bucket waits for a full bucket, not forever."""
+    limiter = RateLimiter(per_minute=10)
+    limiter.acquire(5)
+    limiter.acquire(100)
+    assert fake_clock["now"] == pytest.approx(30.0)
+
+
+def test_rate_limiter_daily_budget(fake_clock):
+    """Once the daily budget is spent, requests follow the daily refill rate."""
+    limiter = RateLimiter(per_minute=600, per_day=864)
+    for _ in range(864):
+        limiter.acquire()
+    # 600 in a burst, the rest at the per-minute rate of 10/s
+    assert fake_clock["now"] == pytest.approx(26.4, abs=0.5)
+
+    start = fake_clock["now"]
+    limiter.acquire()
+    # 864/day refills one token every 100 seconds, a quarter of which
+    # already passed during the burst; the minute bucket alone would allow
+    # the request after 0.1s
+    assert fake_clock["now"] - start == pytest.approx(100.0 - 26.4, abs=0.5)
+
+
+def test_rate_limiter_disabled():
+    """Without a limit acquire never blocks."""
+    RateLimiter().acquire(1_000_000)
+
+
+def test_fetch_hourly_data_multi_chunks_and_unwraps(monkeypatch):
+    """Locations go out chunk_size per call; a bare object counts as one result."""
+    calls = []
+
+    def fake_get(url, params, session=None, weight=1.0):
+        lats = params["latitude"].split(",")
+        calls.append((lats, weight))
+        results = [{"latitude": float(lat)} for lat in lats]
+        return results[0] if len(results) == 1 else results
+
+    monkeypatch.setattr(openmeteo_client, "_get", fake_get)
+
+    payloads = fetch_hourly_data_multi(
+        [(1.0, 10.0), (2.0, 20.0), (3.0, 30.0)],
+        "2025-10-01T00:00",
+        "2025-10-01T06:00",
+        chunk_size=2,
+    )
+    assert [p["latitude"] for p in payloads] == [1.0, 2.0, 3.0]
+    # billed per location
+    assert calls == [(["1.0", "2.0"], 2), (["3.0"], 1)]
+
+
+def test_fetch_hourly_data_multi_rejects_short_responses(monkeypatch):
+    """A response with fewer results than locations is an error, not a shift."""
+    monkeypatch.setattr(
+        openmeteo_client, "_get", lambda url, params, session=None, weight=1.0: [{}]
+    )
+    with pytest.raises(ValueError, match="Expected 2 locations"):
+        fetch_hourly_data_multi(
+            [(1.0, 10.0), (2.0, 20.0)], "2025-10-01T00:00", "2025-10-01T06:00"
+        )
+
+
+class FakeResponse:
+    def __init__(self, status: int, body=None, headers=None):
+        self.status_code = status
+        self.headers = headers or {}
+        self._body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise _http_error(self.status_code)
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    """Answers get() with the queued responses (or raises queued exceptions)."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def no_limiter(monkeypatch):
+    monkeypatch.setattr(openmeteo_client, "LIMITER", RateLimiter())
+
+
+def test_get_retries_transient_errors(fake_clock, no_limiter):
+    """429, 5xx and connection errors are retried; Retry-After is honoured."""
+    session = FakeSession(
+        FakeResponse(429, headers={"Retry-After": "3"}),
+        FakeResponse(503),
+        requests.ConnectionError("reset"),
+        FakeResponse(200, {"ok": True}),
+    )
+    assert openmeteo_client._get("https://x", {}, session) == {"ok": True}
+    assert session.calls == 4
+    assert fake_clock["sleeps"][0] == 3.0
+
+
+def test_get_raises_after_the_last_attempt(fake_clock, no_limiter, monkeypatch):
+    """Once MAX_RETRIES retries are used up the last error is raised."""
+    monkeypatch.setattr(openmeteo_client, "MAX_RETRIES", 2)
+    session = FakeSession(FakeResponse(503), FakeResponse(503), FakeResponse(503))
+    with pytest.raises(requests.HTTPError):
+        openmeteo_client._get("https://x", {}, session)
+    assert session.calls == 3
+
+
+def test_get_does_not_retry_client_errors(fake_clock, no_limiter):
+    """A 400 is the caller's problem: no retries."""
+    session = FakeSession(FakeResponse(400))
+    with pytest.raises(requests.HTTPError):
+        openmeteo_client._get("https://x", {}, session)
+    assert session.calls == 1
+    assert fake_clock["sleeps"] == []
+
+
+def test_get_session_is_shared():
+    """One pooled session per process, replaceable with set_session."""
+    openmeteo_client.set_session(None)
+    try:
+        session = openmeteo_client.get_session()
+        assert openmeteo_client.get_session() is session
+        adapter = session.get_adapter("https://x")
+        assert adapter._pool_maxsize == openmeteo_client.POOL_SIZE
+    finally:
+        openmeteo_client.set_session(None)
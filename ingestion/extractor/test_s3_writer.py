@@ -0,0 +1,183 @@
+"""
+Tests for the raw object writer against a fake S3 client (no MinIO access).
+"""
+
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ingestion.extractor.s3_writer import (
+    CoverageIndex,
+    discover_cities,
+    encode_raw,
+    raw_extension,
+    raw_key,
+    read_raw,
+    write_raw,
+    write_raw_many,
+)
+
+PAYLOAD = {
+    "latitude": 52.23,
+    "longitude": 21.01,
+    "timezone": "GMT",
+    "hourly": {
+        "time": ["2025-10-01T00:00", "2025-10-01T01:00"],
+        "temperature_2m": [1.5, None],
+        "precipitation": [0.0, 0.2],
+        "wind_speed_10m": [3.0, 4.0],
+    },
+}
+
+
+def _store(fake_s3, key: str, payload: dict, fmt: str, compression: str = "") -> None:
+    data, headers = encode_raw(payload, fmt, compression)
+    fake_s3.put_object(Bucket="raw", Key=key, Body=data, **headers)
+
+
+def test_coverage_index_lists_each_partition_once(fake_s3):
+    """Concurrent lookups in one city-day share a single LIST."""
+    fake_s3.list_delay = 0.05
+    fake_s3.put_object(
+        Bucket="raw", Key="weather/Warsaw/ds=2025-10-01/hour=00/a.json", Body=b"a"
+    )
+    coverage = CoverageIndex("raw")
+    keys = [f"weather/Warsaw/ds=2025-10-01/hour={h:02d}/a.json" for h in range(6)]
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        found = list(pool.map(coverage.get, keys))
+
+    assert found == ["0cc175b9c0f1b6a831c399e269772661"] + [None] * 5
+    assert fake_s3.count("ListObjectsV2") == 1
+
+    coverage.get("weather/Warsaw/ds=2025-10-02/hour=00/a.json")
+    assert fake_s3.count("ListObjectsV2") == 2
+
+
+def test_discover_cities(fake_s3):
+    """City folders under the prefix, with or without a trailing slash."""
+    for key in (
+        "weather/Warsaw/ds=2025-10-01/hour=00/a.json",
+        "weather/Berlin/ds=2025-10-01/hour=00/a.json",
+        "weather/stray.json",
+        "other/Paris/ds=2025-10-01/hour=00/a.json",
+    ):
+        fake_s3.put_object(Bucket="raw", Key=key, Body=b"{}")
+
+    assert discover_cities("raw", "weather/") == ["Berlin", "Warsaw"]
+    assert discover_cities("raw", "weather") == ["Berlin", "Warsaw"]
+
+
+def test_parquet_round_trip(fake_s3):
+    """Parquet objects read back into the same payload as JSON ones."""
+    pytest.importorskip("pyarrow")
+    assert raw_extension("parquet") == "parquet"
+    _store(fake_s3, "weather/Warsaw/a.parquet", PAYLOAD, "parquet")
+    assert read_raw("raw", "weather/Warsaw/a.parquet") == PAYLOAD
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_json_round_trip(fake_s3, compression):
+    """Compressed JSON objects are smaller on disk and read back transparently."""
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    ext = raw_extension("json", compression)
+    assert ext == {"gzip": "json.gz", "zstd": "json.zst"}[compression]
+
+    data, headers = encode_raw(PAYLOAD, "json", compression)
+    assert headers["ContentEncoding"] == compression
+    assert data != encode_raw(PAYLOAD, "json", "")[0]
+
+    _store(fake_s3, f"weather/Warsaw/a.{ext}", PAYLOAD, "json", compression)
+    assert read_raw("raw", f"weather/Warsaw/a.{ext}") == PAYLOAD
+
+
+def test_compression_is_deterministic():
+    """Equal payloads compress to equal bytes, so ETags can be compared."""
+    assert encode_raw(PAYLOAD, "json", "gzip") == encode_raw(PAYLOAD, "json", "gzip")
+
+
+def _hour_items(hours):
+    return [
+        ("Warsaw", dt.datetime(2025, 10, 1, h), {"hourly": {"time": [f"h{h}"]}})
+        for h in hours
+    ]
+
+
+def test_write_raw_many_reports_errors_per_item(fake_s3, monkeypatch):
+    """A failed upload is returned in its slot; the others still land, in order."""
+    put = fake_s3.put_object
+
+    def flaky_put(Bucket, Key, Body, **kwargs):
+        if "hour=01" in Key:
+            raise OSError("connection reset")
+        return put(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+
+    monkeypatch.setattr(fake_s3, "put_object", flaky_put)
+
+    results = write_raw_many(
+        "raw", "weather", _hour_items(range(4)), max_workers=4, on_conflict="overwrite"
+    )
+
+    assert [r.key is None for r in results] == [False, True, False, False]
+    assert isinstance(results[1].error, OSError)
+    assert [r.key for r in results if r.key] == [
+        f"weather/Warsaw/ds=2025-10-01/hour={h:02d}/openmeteo_20251001T{h:02d}.json"
+        for h in (0, 2, 3)
+    ]
+    assert all(r.written and r.rows == 1 for r in results if r.key)
+    assert len(fake_s3.objects) == 3
+
+
+def test_write_raw_many_empty():
+    """No items, no client and no threads."""
+    assert write_raw_many("raw", "weather", []) == []
+
+
+def test_raw_keys_are_deterministic():
+    """Same city and hour (or hour range) always map to the same key."""
+    hour = dt.datetime(2025, 10, 1, 7)
+    assert raw_key("weather", "Warsaw", hour, "hour", "json", "", "") == (
+        "weather/Warsaw/ds=2025-10-01/hour=07/openmeteo_20251001T07.json"
+    )
+    assert raw_key(
+        "weather",
+        "Warsaw",
+        hour,
+        "day",
+        "json.gz",
+        "2025-10-01T07:00",
+        "2025-10-01T12:00",
+    ) == ("weather/Warsaw/ds=2025-10-01/openmeteo_20251001_h07-12.json.gz")
+
+
+def _write(payload, on_conflict):
+    return write_raw(
+        "raw",
+        "weather",
+        payload,
+        city="Warsaw",
+        partition_dt=dt.datetime(2025, 10, 1, 0),
+        fmt="json",
+        compression="",
+        on_conflict=on_conflict,
+    )
+
+
+@pytest.mark.parametrize(
+    "on_conflict, same_puts, changed_puts",
+    [("if-changed", 1, 2), ("skip", 1, 1), ("overwrite", 2, 3)],
+)
+def test_on_conflict_policies(fake_s3, on_conflict, same_puts, changed_puts):
+    """Re-writing a key uploads again only as the policy allows."""
+    key = _write(PAYLOAD, on_conflict)
+    assert _write(PAYLOAD, on_conflict) == key
+    assert fake_s3.count("PutObject") == same_puts
+
+    changed = {**PAYLOAD, "latitude": 50.0}
+    assert _write(changed, on_conflict) == key
+    assert fake_s3.count("PutObject") == changed_puts
+    stored = read_raw("raw", key)["latitude"]
+    assert stored == (52.23 if on_conflict == "skip" else 50.0)
+    assert len(fake_s3.objects) == 1
@@ -1,33 +1,27 @@
 # load_to_postgres.py
 import os
-import json
+import re
+import sys
+import io
+import csv
+import datetime as dt
+import itertools
+import collections
 import psycopg2
-import boto3
-from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from typing import Iterator, Tuple
+from typing import Iterable, Iterator, Tuple
 from psycopg2.extras import execute_values
 
-
-def _resolve_endpoint() -> str:
-    ep = (
-        os.getenv("MINIO_ENDPOINT_URL")
-        or os.getenv("MINIO_ENDPOINT")
-        or "http://localhost:9000"
+try:
+    from ingestion.extractor.manifest import iter_manifest
+    from ingestion.extractor.s3_writer import get_s3_client, read_raw
+except ModuleNotFoundError:  # run as a script from ingestion/loader/
+    sys.path.insert(
+        0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../..")
     )
-    if not ep.startswith("http"):
-        ep = f"http://{ep}"
-    return ep
-
-
-S3 = boto3.client(
-    "s3",
-    endpoint_url=_resolve_endpoint(),
-    aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
-    aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD"),
-    region_name=os.getenv("MINIO_REGION", "us-east-1"),
-    config=Config(s3={"addressing_style": "path"}),
-)
+    from ingestion.extractor.manifest import iter_manifest
+    from ingestion.extractor.s3_writer import get_s3_client, read_raw
 
 
 def _connect_pg():
@@ -52,16 +46,17 @@ def _connect_pg():
         return psycopg2.connect(**params)
 
 
-def iter_s3_keys(bucket: str, prefix: str) -> Iterator[Tuple[str, str]]:
+def iter_s3_keys(bucket: str, prefix: str, s3=None) -> Iterator[Tuple[str, str]]:
     """
     Yield (key, etag) for all objects under bucket/prefix, paginated.
     """
+    s3 = s3 or get_s3_client()
     token = None
     while True:
         kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": 1000}
         if token:
             kwargs["ContinuationToken"] = token
-        resp = S3.list_objects_v2(**kwargs)
+        resp = s3.list_objects_v2(**kwargs)
         for obj in resp.get("Contents", []):
             etag = (obj.get("ETag") or "").strip('"')
             yield obj["Key"], etag
@@ -70,9 +65,77 @@ def iter_s3_keys(bucket: str, prefix: str) -> Iterator[Tuple[str, str]]:
         token = resp.get("NextContinuationToken")
 
 
-def _load_key_into_db(pg, cur, bucket: str, key: str, city: str) -> int:
-    obj = S3.get_object(Bucket=bucket, Key=key)
-    payload = json.loads(obj["Body"].read())
+# How far before the watermark a watermark run starts listing. Objects keep
+# changing after their partition was first seen: the hourly DAG rewrites the
+# last 6 hours and the backfill writes up to BACKFILL_DAYS back, so keep this
+# at least as long as both (the etag check makes the overlap cheap).
+WATERMARK_LOOKBACK = dt.timedelta(
+    hours=int(os.getenv("WATERMARK_LOOKBACK_HOURS", str(8 * 24)))
+)
+
+# listed keys looked up in staging._ingest_log per query
+LOG_LOOKUP_BATCH = 1000
+
+_PARTITION_RE = re.compile(r"ds=(\d{4}-\d{2}-\d{2})/(?:hour=(\d{2})/)?")
+
+
+def partition_of(key: str) -> dt.datetime | None:
+    """
+    Parse the ds=/hour= partition of a raw key into a naive datetime.
+
+    Keys without an hour= segment map to midnight of their ds= day; keys without
+    a ds= segment return None.
+    """
+    m = _PARTITION_RE.search(key)
+    if not m:
+        return None
+    day = dt.datetime.strptime(m.group(1), "%Y-%m-%d")
+    return day.replace(hour=int(m.group(2))) if m.group(2) else day
+
+
+def iter_partition_keys(
+    bucket: str,
+    prefix: str,
+    since: dt.datetime,
+    until: dt.datetime | None = None,
+    s3=None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (key, etag) for objects whose partition falls in [since, until].
+
+    Only the ds=YYYY-MM-DD/ prefixes inside the window are listed, so the cost
+    no longer grows with the history kept under prefix. until defaults to now
+    (UTC); both bounds are naive and truncated to the hour like the partitions.
+    """
+    since = since.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    until = (until or dt.datetime.now(dt.UTC)).replace(tzinfo=None)
+    day = since.date()
+    while day <= until.date():
+        for key, etag in iter_s3_keys(bucket, f"{prefix}ds={day:%Y-%m-%d}/", s3):
+            part = partition_of(key)
+            # objects without hour= cover the whole day and are always kept
+            if "/hour=" in key and not since <= part <= until:
+                continue
+            yield key, etag
+        day += dt.timedelta(days=1)
+
+
+UPSERT_SQL = """
+    INSERT INTO staging.weather_hourly
+        (city, "timestamp", temperature_2m, precipitation, wind_speed_10m)
+    VALUES %s
+    ON CONFLICT (city, "timestamp") DO UPDATE
+    SET temperature_2m = EXCLUDED.temperature_2m,
+        precipitation  = EXCLUDED.precipitation,
+        wind_speed_10m = EXCLUDED.wind_speed_10m
+"""
+
+
+def _fetch_rows(bucket: str, key: str, city: str, s3=None) -> list[tuple]:
+    """
+    Download one raw object and decode it into (city, ts, temp, precip, wind) rows.
+    """
+    payload = read_raw(bucket, key, s3 or get_s3_client())
 
     hourly = payload.get("hourly") or {}
     hours = hourly.get("time") or []
@@ -82,55 +145,301 @@ def _load_key_into_db(pg, cur, bucket: str, key: str, city: str) -> int:
 
     # keep only fully-paired rows
     n = min(len(hours), len(temp), len(precip), len(wind))
+    return [(city, hours[i], temp[i], precip[i], wind[i]) for i in range(n)]
+
+
+def prefetch_rows(
+    bucket: str,
+    keys: Iterable[Tuple[str, str]],
+    city: str,
+    workers: int = 8,
+    max_pending: int | None = None,
+    s3=None,
+) -> Iterator[Tuple[str, str, list[tuple]]]:
+    """
+    Yield (key, etag, rows) for each (key, etag) in keys, in input order.
+
+    Objects are downloaded and decoded by a pool of `workers` threads while the
+    caller writes earlier results to Postgres. At most `max_pending` objects
+    (default 4 * workers) are in flight or buffered, so a slow writer stalls the
+    listing instead of growing memory.
+    """
+    max_pending = max_pending or 4 * workers
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for key, etag in keys:
+                pending.append(
+                    (key, etag, pool.submit(_fetch_rows, bucket, key, city, s3))
+                )
+                if len(pending) >= max_pending:
+                    key, etag, fut = pending.popleft()
+                    yield key, etag, fut.result()
+            while pending:
+                key, etag, fut = pending.popleft()
+                yield key, etag, fut.result()
+        finally:
+            # consumer stopped early (limit reached or error): drop queued fetches
+            for _, _, fut in pending:
+                fut.cancel()
+
+
+def _upsert_rows(cur, rows: list[tuple]) -> None:
+    """
+    Upsert rows into staging.weather_hourly with a single statement.
+    """
+    # ON CONFLICT cannot touch the same target row twice per statement, so keep
+    # only the last row seen for each (city, timestamp).
+    rows = list({(row[0], row[1]): row for row in rows}.values())
+    if not rows:
+        return
+    execute_values(cur, UPSERT_SQL, rows, page_size=len(rows))
+
+
+def _copy_rows_into_db(cur, batch: list[list[tuple]]) -> int:
+    """
+    Bulk-merge the rows of many objects into staging.weather_hourly.
+
+    Rows are streamed into a temp table with COPY FROM STDIN and merged with a
+    single INSERT ... ON CONFLICT. `batch` holds one row list per object, in
+    listing order; when several objects carry the same (city, timestamp), the
+    one listed last wins, same as the per-object path.
+    """
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS _weather_hourly_load (
+            seq            int,
+            city           text,
+            "timestamp"    timestamptz,
+            temperature_2m double precision,
+            precipitation  double precision,
+            wind_speed_10m double precision
+        ) ON COMMIT DROP
+    """
+    )
+    cur.execute("TRUNCATE _weather_hourly_load")
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    n = 0
+    for seq, rows in enumerate(batch):
+        for row in rows:
+            writer.writerow((seq, *row))
+            n += 1
     if n == 0:
         return 0
-    rows = [(city, hours[i], temp[i], precip[i], wind[i]) for i in range(n)]
+    buf.seek(0)
 
-    # Upsert in one roundtrip (faster than many INSERTs)
-    execute_values(
-        cur,
+    cur.copy_expert(
+        """
+        COPY _weather_hourly_load
+            (seq, city, "timestamp", temperature_2m, precipitation, wind_speed_10m)
+        FROM STDIN WITH (FORMAT csv)
+    """,
+        buf,
+    )
+    # DISTINCT ON: ON CONFLICT cannot touch the same target row twice per statement
+    cur.execute(
         """
         INSERT INTO staging.weather_hourly
             (city, "timestamp", temperature_2m, precipitation, wind_speed_10m)
-        VALUES %s
+        SELECT DISTINCT ON (city, "timestamp")
+            city, "timestamp", temperature_2m, precipitation, wind_speed_10m
+        FROM _weather_hourly_load
+        ORDER BY city, "timestamp", seq DESC
         ON CONFLICT (city, "timestamp") DO UPDATE
         SET temperature_2m = EXCLUDED.temperature_2m,
             precipitation  = EXCLUDED.precipitation,
             wind_speed_10m = EXCLUDED.wind_speed_10m
-        """,
-        rows,
+    """
     )
     return n
 
 
-def load_one(s3_uri: str, city: str) -> int:
-    # s3://raw/weather/ds=.../openmeteo_...json
-    parsed = urlparse(s3_uri)
-    obj = S3.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
-    payload = json.loads(obj["Body"].read())
+def _create_ingest_tables(cur, log: bool = True, watermark: bool = True) -> None:
+    if log:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS staging._ingest_log (
+                bucket text NOT NULL,
+                key    text PRIMARY KEY,
+                etag   text,
+                rows_inserted int,
+                ingested_at timestamptz DEFAULT now()
+            )
+        """
+        )
+    if watermark:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS staging._ingest_watermark (
+                bucket text NOT NULL,
+                prefix text NOT NULL,
+                last_partition timestamp NOT NULL,
+                updated_at timestamptz DEFAULT now(),
+                PRIMARY KEY (bucket, prefix)
+            )
+        """
+        )
 
-    hours = payload["hourly"]["time"]
-    temp = payload["hourly"]["temperature_2m"]
-    precip = payload["hourly"]["precipitation"]
-    wind = payload["hourly"]["wind_speed_10m"]
-    rows = list(zip(hours, temp, precip, wind))
 
+def ensure_ingest_tables() -> None:
+    """
+    Create the loader bookkeeping tables up front.
+
+    Concurrent CREATE TABLE IF NOT EXISTS can still collide, so callers running
+    load_all_weather from several workers should call this once beforehand.
+    """
     with _connect_pg() as pg, pg.cursor() as cur:
-        for ts, t, p, w in rows:
-            cur.execute(
-                """
-                INSERT INTO staging.weather_hourly
-                    (city, "timestamp", temperature_2m, precipitation, wind_speed_10m)
-                VALUES
-                    (%s, %s::timestamptz, %s, %s, %s)
-                ON CONFLICT (city, "timestamp") DO UPDATE
-                SET temperature_2m = EXCLUDED.temperature_2m,
-                    precipitation  = EXCLUDED.precipitation,
-                    wind_speed_10m = EXCLUDED.wind_speed_10m;
-                """,
-                (city, ts, t, p, w),
-            )
-    return len(rows)
+        _create_ingest_tables(cur)
+
+
+def _read_watermark(cur, bucket: str, prefix: str) -> dt.datetime | None:
+    cur.execute(
+        """
+        SELECT last_partition FROM staging._ingest_watermark
+        WHERE bucket = %s AND prefix = %s
+    """,
+        (bucket, prefix),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _write_watermark(cur, bucket: str, prefix: str, partition: dt.datetime) -> None:
+    # GREATEST: an explicit backfill window must never move the watermark back
+    cur.execute(
+        """
+        INSERT INTO staging._ingest_watermark (bucket, prefix, last_partition)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (bucket, prefix) DO UPDATE
+          SET last_partition = GREATEST(
+                  staging._ingest_watermark.last_partition,
+                  EXCLUDED.last_partition
+              ),
+              updated_at = now()
+    """,
+        (bucket, prefix, partition),
+    )
+
+
+def _log_ingested(cur, bucket: str, entries: list[tuple[str, str, int]]) -> None:
+    """Record (key, etag, rows) entries in staging._ingest_log in one roundtrip."""
+    if not entries:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO staging._ingest_log (bucket, key, etag, rows_inserted)
+        VALUES %s
+        ON CONFLICT (key) DO UPDATE
+          SET etag = EXCLUDED.etag,
+              rows_inserted = EXCLUDED.rows_inserted,
+              ingested_at = now()
+    """,
+        [(bucket, key, etag, rows) for key, etag, rows in entries],
+    )
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
+def _logged_etags_for(cur, keys: list[str]) -> dict[str, str]:
+    """Return {key: etag} from staging._ingest_log for the given keys."""
+    if not keys:
+        return {}
+    cur.execute(
+        "SELECT key, etag FROM staging._ingest_log WHERE key = ANY(%s)", (keys,)
+    )
+    return dict(cur.fetchall())
+
+
+def load_many(
+    uris_by_city: dict[str, list[str]], etags: dict[str, str] | None = None
+) -> dict[str, int]:
+    """
+    Load many raw objects over a single Postgres connection.
+
+    Args:
+        uris_by_city: Dict with city names as keys, lists of S3 URIs as values
+        etags: Optional {s3_uri: etag}, e.g. from a run manifest. URIs already
+            recorded in staging._ingest_log with the same etag are skipped,
+            and loaded ones are recorded there (as load_all_weather does), so
+            a retried or repeated run only loads what is missing. The log
+            table must exist: call ensure_ingest_tables once beforehand
+            instead of from every concurrent caller
+
+    Returns:
+        Dict mapping each loaded S3 URI to the number of rows it contributed;
+        skipped URIs are left out
+    """
+    with _connect_pg() as pg, pg.cursor() as cur:
+        return _load_uris(cur, uris_by_city, etags)
+
+
+def _load_uris(
+    cur, uris_by_city: dict[str, list[str]], etags: dict[str, str] | None
+) -> dict[str, int]:
+    """load_many on an open cursor."""
+    counts = {}
+    logged = {}
+    if etags:
+        logged = _logged_etags_for(
+            cur, [urlparse(uri).path.lstrip("/") for uri in etags]
+        )
+
+    for city, s3_uris in uris_by_city.items():
+        rows = []
+        to_log = collections.defaultdict(list)  # bucket -> (key, etag, rows)
+        for s3_uri in s3_uris:
+            # s3://raw/weather/ds=.../openmeteo_...json
+            parsed = urlparse(s3_uri)
+            bucket, key = parsed.netloc, parsed.path.lstrip("/")
+            etag = (etags or {}).get(s3_uri)
+            if etag and logged.get(key) == etag:
+                continue  # already loaded and unchanged since
+            uri_rows = _fetch_rows(bucket, key, city)
+            counts[s3_uri] = len(uri_rows)
+            rows.extend(uri_rows)
+            if etag:
+                to_log[bucket].append((key, etag, len(uri_rows)))
+
+        # one batched upsert per city, logged in the same transaction
+        _upsert_rows(cur, rows)
+        for bucket, entries in to_log.items():
+            _log_ingested(cur, bucket, entries)
+    return counts
+
+
+def load_manifest(
+    bucket: str, key: str, batch_size: int = LOG_LOOKUP_BATCH
+) -> Iterator[tuple[dict, int | None]]:
+    """
+    Stream a run manifest into Postgres, batch_size entries at a time.
+
+    The manifest is read once and never held in memory as a whole; each batch
+    is loaded like load_many with the entries' etags, over one connection.
+
+    Yields:
+        (entry, rows) per manifest entry, in manifest order; rows is None for
+        objects skipped because staging._ingest_log already has their etag
+    """
+    with _connect_pg() as pg, pg.cursor() as cur:
+        for chunk in _chunks(iter_manifest(bucket, key), batch_size):
+            uris_by_city = collections.defaultdict(list)
+            for entry in chunk:
+                uris_by_city[entry["city"]].append(entry["uri"])
+            etags = {e["uri"]: e["md5"] for e in chunk if e.get("md5")}
+            counts = _load_uris(cur, uris_by_city, etags)
+            for entry in chunk:
+                yield entry, counts.get(entry["uri"])
+
+
+def load_one(s3_uri: str, city: str) -> int:
+    return load_many({city: [s3_uri]})[s3_uri]
 
 
 def load_all_weather(
@@ -139,52 +448,98 @@ def load_all_weather(
     prefix: str = "weather/",
     skip_logged: bool = True,
     limit_files: int | None = None,
+    bulk: bool = False,
+    batch_size: int = 500,
+    fetch_workers: int = 8,
+    max_pending: int | None = None,
+    since: dt.datetime | None = None,
+    until: dt.datetime | None = None,
+    use_watermark: bool = False,
+    watermark_lookback: dt.timedelta = WATERMARK_LOOKBACK,
+    s3=None,
 ) -> tuple[int, int]:
     """
     Load ALL objects under s3://{bucket}/{prefix} into staging.weather_hourly.
     Returns (files_processed, total_rows_inserted).
-    If skip_logged=True, records processed keys and skips them next time.
+    If skip_logged=True, records processed keys and etags and skips them next
+    time, unless the object's etag has changed since.
+    If bulk=True, objects are merged batch_size at a time via COPY into a temp
+    table instead of one upsert per object.
+    Objects are fetched by fetch_workers threads ahead of the DB writes, with at
+    most max_pending objects buffered (see prefetch_rows).
+    If since is given, only ds= partitions in [since, until] are listed. If
+    use_watermark=True, a missing since defaults to the last partition seen
+    by a previous run minus watermark_lookback (late rewrites and backfills
+    land in older partitions), and the watermark is advanced at the end of
+    this one.
+    s3 replaces the shared client from s3_writer.get_s3_client() for this
+    call (e.g. a differently configured client, or a fake in tests).
     """
     files = 0
     total_rows = 0
     with _connect_pg() as pg, pg.cursor() as cur:
-        if skip_logged:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS staging._ingest_log (
-                    bucket text NOT NULL,
-                    key    text PRIMARY KEY,
-                    etag   text,
-                    rows_inserted int,
-                    ingested_at timestamptz DEFAULT now()
+        _create_ingest_tables(cur, log=skip_logged, watermark=use_watermark)
+        if use_watermark and since is None:
+            watermark = _read_watermark(cur, bucket, prefix)
+            if watermark is not None:
+                since = watermark - watermark_lookback
+
+        if since is not None:
+            listing = iter_partition_keys(bucket, prefix, since, until, s3)
+        else:
+            listing = iter_s3_keys(bucket, prefix, s3)
+
+        latest = None  # newest partition handed to the writer
+
+        def pending_keys():
+            nonlocal latest
+            # look up only the listed keys, LOG_LOOKUP_BATCH per query (a PK
+            # lookup), so a run costs what it lists, not the whole log
+            for chunk in _chunks(listing, LOG_LOOKUP_BATCH):
+                logged = (
+                    _logged_etags_for(cur, [key for key, _ in chunk])
+                    if skip_logged
+                    else {}
                 )
-            """
-            )
+                for key, etag in chunk:
+                    part = partition_of(key)
+                    if part is not None and (latest is None or part > latest):
+                        latest = part
+                    if key in logged and logged[key] == etag:
+                        continue  # already processed and unchanged since
+                    yield key, etag
 
-        for key, etag in iter_s3_keys(bucket, prefix):
+        batch = []  # (key, etag, rows) waiting for a bulk flush
+
+        def flush():
+            if not batch:
+                return
+            _copy_rows_into_db(cur, [rows for _, _, rows in batch])
             if skip_logged:
-                cur.execute("SELECT 1 FROM staging._ingest_log WHERE key = %s", (key,))
-                if cur.fetchone():
-                    continue  # already processed
+                _log_ingested(
+                    cur, bucket, [(key, etag, len(rows)) for key, etag, rows in batch]
+                )
+            batch.clear()
 
-            rows = _load_key_into_db(pg, cur, bucket, key, city)
-            total_rows += rows
+        keys = itertools.islice(pending_keys(), limit_files or None)
+        for key, etag, rows in prefetch_rows(
+            bucket, keys, city, workers=fetch_workers, max_pending=max_pending, s3=s3
+        ):
+            if bulk:
+                batch.append((key, etag, rows))
+                if len(batch) >= batch_size:
+                    flush()
+            else:
+                _upsert_rows(cur, rows)
+                if skip_logged:
+                    _log_ingested(cur, bucket, [(key, etag, len(rows))])
+
+            total_rows += len(rows)
             files += 1
 
-            if skip_logged:
-                cur.execute(
-                    """
-                    INSERT INTO staging._ingest_log (bucket, key, etag, rows_inserted)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (key) DO UPDATE
-                      SET etag = EXCLUDED.etag,
-                          rows_inserted = EXCLUDED.rows_inserted,
-                          ingested_at = now()
-                """,
-                    (bucket, key, etag, rows),
-                )
+        flush()
 
-            if limit_files and files >= limit_files:
-                break
+        if use_watermark and latest is not None:
+            _write_watermark(cur, bucket, prefix, latest)
 
     return files, total_rows
@@ -1,18 +1,11 @@
 import os
-import boto3
-from botocore.config import Config
-from load_to_postgres import load_all_weather
+import time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from load_to_postgres import ensure_ingest_tables, load_all_weather
 
-
-def _resolve_endpoint() -> str:
-    ep = (
-        os.getenv("MINIO_ENDPOINT_URL")
-        or os.getenv("MINIO_ENDPOINT")
-        or "http://localhost:9000"
-    )
-    if not ep.startswith("http"):
-        ep = f"http://{ep}"
-    return ep
+# importable now: load_to_postgres puts the repo root on sys.path
+from ingestion.extractor.s3_writer import discover_cities
 
 
 def _to_bool(s: str | None, default=True) -> bool:
@@ -28,30 +21,26 @@ def _to_int(s: str | None):
         return None
 
 
-def discover_cities(bucket: str, base_prefix: str = "weather/") -> list[str]:
-    """Discover city folders in MinIO by listing prefixes under base_prefix."""
-    s3 = boto3.client(
-        "s3",
-        endpoint_url=_resolve_endpoint(),
-        aws_access_key_id=os.getenv("MINIO_ROOT_USER"),
-        aws_secret_access_key=os.getenv("MINIO_ROOT_PASSWORD"),
-        region_name=os.getenv("MINIO_REGION", "us-east-1"),
-        config=Config(s3={"addressing_style": "path"}),
-    )
-
-    cities = set()
-    paginator = s3.get_paginator("list_objects_v2")
+def _to_datetime(s: str | None):
+    try:
+        return dt.datetime.fromisoformat(s) if s else None
+    except ValueError:
+        return None
 
-    for page in paginator.paginate(Bucket=bucket, Prefix=base_prefix, Delimiter="/"):
-        # CommonPrefixes gives us the "folders"
-        for prefix_info in page.get("CommonPrefixes", []):
-            prefix = prefix_info["Prefix"]
-            # Extract city name: "weather/Warsaw/" -> "Warsaw"
-            city = prefix.replace(base_prefix, "").strip("/")
-            if city:
-                cities.add(city)
 
-    return sorted(cities)
+def load_city(city: str, bucket: str, base_prefix: str, **load_kwargs) -> tuple:
+    """
+    Load one city (load_all_weather opens its own Postgres connection; the
+    S3 client is shared). Returns (files, rows, seconds); exceptions propagate.
+    """
+    start = time.perf_counter()
+    files, rows = load_all_weather(
+        city=city,
+        bucket=bucket,
+        prefix=f"{base_prefix}{city}/",
+        **load_kwargs,
+    )
+    return files, rows, time.perf_counter() - start
 
 
 if __name__ == "__main__":
@@ -61,6 +50,14 @@ if __name__ == "__main__":
     limit_files = _to_int(
         os.getenv("LIMIT_FILES")
     )  # optional: cap number of files this run
+    bulk = _to_bool(os.getenv("BULK_LOAD"), default=False)
+    batch_size = _to_int(os.getenv("BATCH_SIZE")) or 500
+    fetch_workers = _to_int(os.getenv("FETCH_WORKERS")) or 8
+    max_pending = _to_int(os.getenv("MAX_PENDING"))  # default: 4 * FETCH_WORKERS
+    # optional partition window, e.g. SINCE=2025-10-01T00 UNTIL=2025-10-31T23
+    since = _to_datetime(os.getenv("SINCE"))
+    until = _to_datetime(os.getenv("UNTIL"))
+    use_watermark = _to_bool(os.getenv("USE_WATERMARK"), default=False)
 
     print("=" * 60)
     print("Discovering cities from MinIO...")
@@ -75,26 +72,44 @@ if __name__ == "__main__":
 
     print(f"Found {len(cities)} cities: {', '.join(cities)}\n")
 
+    load_kwargs = dict(
+        skip_logged=skip_logged,
+        limit_files=limit_files,
+        bulk=bulk,
+        batch_size=batch_size,
+        fetch_workers=fetch_workers,
+        max_pending=max_pending,
+        since=since,
+        until=until,
+        use_watermark=use_watermark,
+    )
+
     total_files = 0
     total_rows = 0
 
-    for city in cities:
-        prefix = f"{base_prefix}{city}/"
-        print(f"[{city}] Loading from s3://{bucket}/{prefix}")
-
-        try:
-            files, rows = load_all_weather(
-                city=city,
-                bucket=bucket,
-                prefix=prefix,
-                skip_logged=skip_logged,
-                limit_files=limit_files,
-            )
-            print(f"[{city}] ✓ Processed {files} files, {rows} rows upserted")
-            total_files += files
-            total_rows += rows
-        except Exception as e:
-            print(f"[{city}] ✗ Failed: {e}")
+    # cities are independent: load up to LOAD_WORKERS of them at once
+    load_workers = max(1, min(_to_int(os.getenv("LOAD_WORKERS")) or 1, len(cities)))
+    if load_workers > 1:
+        ensure_ingest_tables()  # avoid concurrent CREATE TABLE races
+
+    with ThreadPoolExecutor(max_workers=load_workers) as pool:
+        futures = {}
+        for city in cities:
+            print(f"[{city}] Loading from s3://{bucket}/{base_prefix}{city}/")
+            fut = pool.submit(load_city, city, bucket, base_prefix, **load_kwargs)
+            futures[fut] = city
+
+        for fut in as_completed(futures):
+            city = futures[fut]
+            try:
+                files, rows, seconds = fut.result()
+                print(
+                    f"[{city}] ✓ Processed {files} files, {rows} rows upserted in {seconds:.1f}s"
+                )
+                total_files += files
+                total_rows += rows
+            except Exception as e:
+                print(f"[{city}] ✗ Failed: {e}")
 
     print("\n" + "=" * 60)
     print(
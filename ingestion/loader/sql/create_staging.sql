@@ -8,4 +8,21 @@ CREATE TABLE IF NOT EXISTS staging.weather_hourly (
     wind_speed_10m DOUBLE PRECISION,
     _ingested_at TIMESTAMPTZ DEFAULT NOW(),
     PRIMARY KEY (city, timestamp)
-)
\ No newline at end of file
+);
+
+-- loader bookkeeping (also created by load_to_postgres.ensure_ingest_tables)
+CREATE TABLE IF NOT EXISTS staging._ingest_log (
+    bucket TEXT NOT NULL,
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    rows_inserted INT,
+    ingested_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS staging._ingest_watermark (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    last_partition TIMESTAMP NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (bucket, prefix)
+);
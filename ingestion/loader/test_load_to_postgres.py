@@ -0,0 +1,167 @@
+"""
+Tests for the loader helpers with fake S3 and Postgres clients.
+"""
+
+import datetime as dt
+
+from ingestion.extractor.manifest import write_manifest
+from ingestion.loader import load_to_postgres
+from ingestion.loader.load_to_postgres import (
+    iter_partition_keys,
+    load_all_weather,
+    load_manifest,
+    partition_of,
+)
+
+
+class FakeS3:
+    """Just enough of list_objects_v2 for iter_s3_keys, one key per page."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.prefixes = []
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys, ContinuationToken=None):
+        if ContinuationToken is None:
+            self.prefixes.append(Prefix)
+        matching = [k for k in self.keys if k.startswith(Prefix)]
+        i = int(ContinuationToken or 0)
+        page = matching[i : i + 1]
+        resp = {"Contents": [{"Key": k, "ETag": f'"etag-{k}"'} for k in page]}
+        if i + 1 < len(matching):
+            resp.update(IsTruncated=True, NextContinuationToken=str(i + 1))
+        return resp
+
+
+class FakeCursor:
+    """Records statements; answers _ingest_log lookups from `logged`."""
+
+    def __init__(self, logged):
+        self.logged = logged
+        self.statements = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+        if "FROM staging._ingest_log" in sql:
+            keys = params[0]
+            self._result = [(k, self.logged[k]) for k in keys if k in self.logged]
+
+    def fetchall(self):
+        return self._result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_partition_of():
+    """Hourly keys map to their hour, daily keys to midnight, others to None."""
+    assert partition_of("weather/Warsaw/ds=2025-10-01/hour=07/x.json") == (
+        dt.datetime(2025, 10, 1, 7)
+    )
+    assert partition_of("weather/Warsaw/ds=2025-10-01/openmeteo.json.gz") == (
+        dt.datetime(2025, 10, 1)
+    )
+    assert partition_of("weather/Warsaw/openmeteo_20251001.json") is None
+
+
+def test_iter_partition_keys_lists_only_the_window():
+    """Only ds= days in the window are listed, and hours outside it are dropped."""
+    keys = [
+        "weather/Warsaw/ds=2025-09-30/hour=23/a.json",
+        "weather/Warsaw/ds=2025-10-01/hour=05/b.json",
+        "weather/Warsaw/ds=2025-10-01/hour=06/c.json",
+        "weather/Warsaw/ds=2025-10-02/hour=01/d.json",
+        "weather/Warsaw/ds=2025-10-02/day.json",
+        "weather/Warsaw/ds=2025-10-02/hour=03/e.json",
+        "weather/Warsaw/ds=2025-10-03/hour=00/f.json",
+    ]
+    s3 = FakeS3(keys)
+
+    found = list(
+        iter_partition_keys(
+            "raw",
+            "weather/Warsaw/",
+            since=dt.datetime(2025, 10, 1, 6, 30),
+            until=dt.datetime(2025, 10, 2, 2),
+            s3=s3,
+        )
+    )
+
+    assert found == [
+        ("weather/Warsaw/ds=2025-10-01/hour=06/c.json", "etag-" + keys[2]),
+        ("weather/Warsaw/ds=2025-10-02/hour=01/d.json", "etag-" + keys[3]),
+        ("weather/Warsaw/ds=2025-10-02/day.json", "etag-" + keys[4]),
+    ]
+    assert s3.prefixes == [
+        "weather/Warsaw/ds=2025-10-01/",
+        "weather/Warsaw/ds=2025-10-02/",
+    ]
+
+
+def test_load_all_weather_looks_up_listed_keys_in_batches(monkeypatch):
+    """Only the listed keys are looked up in the log, a batch at a time."""
+    keys = [f"weather/Warsaw/ds=2025-10-01/hour={h:02d}/a.json" for h in range(5)]
+    cur = FakeCursor({k: f"etag-{k}" for k in keys})
+    monkeypatch.setattr(load_to_postgres, "_connect_pg", lambda: FakeConnection(cur))
+    monkeypatch.setattr(load_to_postgres, "LOG_LOOKUP_BATCH", 2)
+
+    files, rows = load_all_weather("Warsaw", prefix="weather/Warsaw/", s3=FakeS3(keys))
+
+    assert (files, rows) == (0, 0)  # everything was logged with the same etag
+    lookups = [p[0] for sql, p in cur.statements if "FROM staging._ingest_log" in sql]
+    assert lookups == [keys[0:2], keys[2:4], keys[4:5]]
+    assert not any("starts_with" in sql for sql, _ in cur.statements)
+
+
+def test_load_manifest_streams_the_manifest_once(monkeypatch, fake_s3):
+    """One manifest read; batches skip logged objects and load the rest."""
+    entries = [
+        {
+            "city": "Warsaw",
+            "uri": f"s3://raw/weather/Warsaw/ds=2025-10-01/hour={h:02d}/a.json",
+            "md5": f"md5-{h}",
+        }
+        for h in range(3)
+    ]
+    key = write_manifest("raw", "etl_openmeteo/run/Warsaw", entries)
+    s3_keys = [e["uri"].removeprefix("s3://raw/") for e in entries]
+    cur = FakeCursor({s3_keys[0]: "md5-0", s3_keys[1]: "md5-1"})
+    upserted, logged = [], []
+    monkeypatch.setattr(load_to_postgres, "_connect_pg", lambda: FakeConnection(cur))
+    monkeypatch.setattr(
+        load_to_postgres, "_fetch_rows", lambda bucket, key, city: [(city, key)]
+    )
+    monkeypatch.setattr(
+        load_to_postgres, "_upsert_rows", lambda cur, rows: upserted.extend(rows)
+    )
+    monkeypatch.setattr(
+        load_to_postgres, "_log_ingested", lambda cur, b, rows: logged.extend(rows)
+    )
+
+    results = list(load_manifest("raw", key, batch_size=2))
+
+    assert [rows for _, rows in results] == [None, None, 1]
+    assert [entry for entry, _ in results] == entries
+    assert upserted == [("Warsaw", s3_keys[2])]
+    assert logged == [(s3_keys[2], "md5-2", 1)]
+    assert fake_s3.count("GetObject") == 1
+    lookups = [p[0] for sql, p in cur.statements if "FROM staging._ingest_log" in sql]
+    assert lookups == [s3_keys[:2], s3_keys[2:]]